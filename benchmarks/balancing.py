@@ -0,0 +1,279 @@
+"""
+Load balancer simulator
+
+Replays player arrivals and departures against the real `LoadBalancer` in virtual time, with
+simulated nodes that send a stats frame every minute. Nodes get busier as players are put on them
+and start losing frames once they pass `--saturation` of their capacity. Each parameter set of
+`Penalties` is run on the same traffic, and the imbalance, peak frame deficit and migrations are
+reported for every one of them.
+
+`--strategy` runs the built-in balancing strategies as well, the parameter sets apply to the
+ones that score nodes with Penalties.
+
+The traffic is synthetic (a day/night cycle) unless `--trace` is given, a JSON lines file with a
+`{"time": seconds, "duration": seconds}` session per line. `--background` replays recorded system
+load, `{"time": seconds, "node": index, "system_load": 0-1}` per line, on top of what the players cause.
+
+Usage:
+    python -m benchmarks.balancing [--nodes 20] [--players 3000] [--hours 24] [--outage 0:3600:600]
+                                   [--params default "CPU_BASE=1.1,DEFICIT_WEIGHT=1200"]
+                                   [--strategy penalty power-of-two least-playing consistent-hash]
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import math
+import random
+import sys
+import time
+
+from core.load_balancing import STRATEGIES, LoadBalancer, Penalties, PenaltyStrategy
+from core.stats import NodeStats, StatsHistory
+
+STATS_INTERVAL = 60
+FRAMES_PER_MINUTE = 3000
+
+
+class SimNode:
+    """
+    A node that only has what the load balancer looks at
+    """
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.connected = True
+        self.links = {}
+        self.stats = None
+        self.stats_history = StatsHistory()
+        self.pending_players = 0
+        self.background_load = 0.0
+        self.frame_deficit = 0.0
+
+    def links_changed(self, delta):
+        self.pending_players += delta
+
+    def publish_load(self):
+        pass
+
+    def send_stats(self, timestamp, rng, saturation):
+        playing = len(self.links)
+        utilization = playing / self.capacity
+        system_load = min(1.0, max(0.0, 0.02 + utilization + self.background_load + rng.gauss(0, 0.02)))
+        # Past saturation the node can't keep up and frames go missing
+        overload = max(0.0, system_load - saturation) / (1 - saturation)
+        self.frame_deficit = min(FRAMES_PER_MINUTE, FRAMES_PER_MINUTE * overload * overload) if playing else 0.0
+        msg = {
+            "playingPlayers": playing,
+            "players": playing,
+            "memory": {},
+            "cpu": {"cores": 4, "systemLoad": system_load, "lavalinkLoad": system_load},
+        }
+        if playing:
+            msg["frameStats"] = {
+                "sent": FRAMES_PER_MINUTE - self.frame_deficit,
+                "deficit": self.frame_deficit,
+                "nulled": self.frame_deficit / 10,
+            }
+        self.stats = NodeStats(msg)
+        self.stats_history.add(self.stats, timestamp)
+        self.pending_players = 0
+
+
+class SimLink:
+    def __init__(self, guild_id, result):
+        self.guild_id = guild_id
+        self.node = None
+        self.result = result
+
+    async def change_node(self, node):
+        if self.node and self.node is not node:
+            self.node.links.pop(self.guild_id, None)
+            self.node.links_changed(-1)
+            self.result["migrations"] += 1
+        self.node = node
+        if self.guild_id not in node.links:
+            node.links[self.guild_id] = self
+            node.links_changed(1)
+
+
+class SimLavalink:
+    def __init__(self, nodes):
+        self.nodes = {node.name: node for node in nodes}
+        self.links = {}
+        self.stats_board = None
+
+
+def synthetic_sessions(players, duration, seconds, rng):
+    """
+    Sessions arriving with a day/night cycle, about `players` are playing on average
+    """
+    mean_rate = players / duration
+    t = 0.0
+    while True:
+        rate = mean_rate * (1 + 0.6 * math.sin(2 * math.pi * t / 86400))
+        t += rng.expovariate(max(rate, mean_rate * 0.05))
+        if t >= seconds:
+            return
+        yield t, rng.expovariate(1 / duration)
+
+
+def recorded(path, seconds):
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["time"] < seconds:
+                yield entry["time"], entry["duration"]
+
+
+def make_penalties(spec):
+    """
+    Make a Penalties subclass from "NAME=value,NAME=value", "default" is Penalties itself
+    """
+    if spec == "default":
+        return Penalties
+    overrides = {}
+    for pair in spec.split(","):
+        name, value = pair.split("=")
+        name = name.strip().upper()
+        if not hasattr(Penalties, name):
+            raise SystemExit(f"Penalties has no {name}")
+        overrides[name] = float(value)
+    return type("TunedPenalties", (Penalties,), overrides)
+
+
+async def simulate(make_balancer, args, capacities, background):
+    rng = random.Random(args.seed)
+    # PowerOfTwoStrategy samples with the random module
+    random.seed(args.seed)
+    nodes = [SimNode(f"node-{i}", capacity) for i, capacity in enumerate(capacities)]
+    lavalink = SimLavalink(nodes)
+    balancer = make_balancer(lavalink)
+    result = {"arrivals": 0, "rejected": 0, "migrations": 0, "imbalance": [], "peak_deficit": 0.0,
+              "decision_time": 0.0}
+
+    seconds = args.hours * 3600
+    if args.trace:
+        sessions = recorded(args.trace, seconds)
+    else:
+        sessions = synthetic_sessions(args.players, args.duration, seconds, random.Random(args.seed + 1))
+
+    # Events are (time, order, kind, data), the order keeps ties stable
+    events = []
+    order = 0
+
+    def schedule(at, kind, data=None):
+        nonlocal order
+        order += 1
+        heapq.heappush(events, (at, order, kind, data))
+
+    for at in range(0, int(seconds), STATS_INTERVAL):
+        schedule(at, "stats")
+    for entry in background:
+        schedule(entry["time"], "background", entry)
+    if args.outage:
+        index, start, length = (int(part) for part in args.outage.split(":"))
+        schedule(start, "down", nodes[index])
+        schedule(start + length, "up", nodes[index])
+
+    next_session = next(sessions, None)
+    guild_id = 0
+    while events or next_session:
+        if next_session and (not events or next_session[0] < events[0][0]):
+            at, duration = next_session
+            next_session = next(sessions, None)
+            guild_id += 1
+            link = SimLink(guild_id, result)
+            result["arrivals"] += 1
+            decision_start = time.perf_counter()
+            try:
+                node = await balancer.determine_best_node(link)
+            except Exception:
+                result["rejected"] += 1
+                continue
+            finally:
+                result["decision_time"] += time.perf_counter() - decision_start
+            lavalink.links[guild_id] = link
+            await link.change_node(node)
+            schedule(at + duration, "leave", link)
+            continue
+
+        at, _, kind, data = heapq.heappop(events)
+        if kind == "leave":
+            lavalink.links.pop(data.guild_id, None)
+            if data.node.links.pop(data.guild_id, None):
+                data.node.links_changed(-1)
+        elif kind == "stats":
+            for node in nodes:
+                if node.connected:
+                    node.send_stats(at, rng, args.saturation)
+                    result["peak_deficit"] = max(result["peak_deficit"], node.frame_deficit)
+            loads = [len(node.links) / node.capacity for node in nodes if node.connected]
+            if len(loads) > 1 and any(loads):
+                result["imbalance"].append(max(loads) - min(loads))
+        elif kind == "background":
+            nodes[data["node"]].background_load = data["system_load"]
+        elif kind == "down":
+            data.connected = False
+            await balancer.on_node_disconnect(data)
+        elif kind == "up":
+            data.connected = True
+            await balancer.on_node_connect(data)
+    return result
+
+
+def report(name, result, elapsed):
+    imbalance = sorted(result["imbalance"]) or [0.0]
+    mean = sum(imbalance) / len(imbalance)
+    p95 = imbalance[min(len(imbalance) - 1, int(len(imbalance) * 0.95))]
+    decision = result["decision_time"] / max(result["arrivals"], 1) * 1e6
+    print(f"{name:>40}: imbalance mean {mean:6.1%} p95 {p95:6.1%}, peak deficit {result['peak_deficit']:7.1f}/min, "
+          f"migrations {result['migrations']:>6}, rejected {result['rejected']:>5}, decisions {decision:5.1f}us, "
+          f"{result['arrivals']:,} arrivals in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=20, help="The amount of nodes")
+    parser.add_argument("--capacity", type=int, nargs=2, default=[300, 700], metavar=("MIN", "MAX"),
+                        help="The range of players a node can handle at full load")
+    parser.add_argument("--players", type=int, default=3000, help="The average amount of playing players")
+    parser.add_argument("--duration", type=float, default=1800, help="The average session length in seconds")
+    parser.add_argument("--hours", type=float, default=24, help="The amount of virtual hours to simulate")
+    parser.add_argument("--saturation", type=float, default=0.85, help="The load at which nodes start losing frames")
+    parser.add_argument("--outage", help="Take a node down, as index:start:length in seconds")
+    parser.add_argument("--trace", help="A JSON lines file of sessions to replay instead of synthetic traffic")
+    parser.add_argument("--background", help="A JSON lines file of recorded system load per node")
+    parser.add_argument("--params", nargs="+", default=["default"],
+                        help='Penalties parameter sets to compare, "default" or "NAME=value,..."')
+    parser.add_argument("--strategy", nargs="+", default=["penalty"], choices=list(STRATEGIES),
+                        help="The balancing strategies to compare")
+    parser.add_argument("--seed", type=int, default=1, help="The seed of the random traffic and noise")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    capacities = [rng.randint(*args.capacity) for _ in range(args.nodes)]
+    background = []
+    if args.background:
+        with open(args.background) as f:
+            background = [json.loads(line) for line in f]
+
+    loop = asyncio.get_event_loop()
+    for name in args.strategy:
+        strategy_class = STRATEGIES[name]
+        specs = args.params if issubclass(strategy_class, PenaltyStrategy) else ["default"]
+        for spec in specs:
+            penalties = make_penalties(spec)
+
+            def make_balancer(lavalink):
+                return LoadBalancer(lavalink, penalties, name)
+
+            start = time.perf_counter()
+            result = loop.run_until_complete(simulate(make_balancer, args, capacities, background))
+            report(name if spec == "default" else f"{name} {spec}", result, time.perf_counter() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
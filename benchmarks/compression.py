@@ -0,0 +1,132 @@
+"""
+Websocket compression benchmark
+
+Runs a local websocket server that supports permessage-deflate, floods each Transport with
+Lavalink-like frames and has it send frames back, once per compression setting. Reports the bytes
+on the wire, the compression ratio and the CPU time spent per message, so you can tell whether a
+node is better off saving bandwidth or CPU.
+
+Usage:
+    python -m benchmarks.compression [-n 20000] [--transport aiohttp websockets] [--levels 1 6 9]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from core.transport import Compression, MessageType, get_transport
+
+
+def make_frames(count):
+    rng = random.Random(1)
+    frames = []
+    for i in range(count):
+        if i % 100 == 0:
+            frames.append(json.dumps({
+                "op": "stats", "players": 4000, "playingPlayers": 3500, "uptime": 123456789,
+                "memory": {"free": 1000000, "used": 2000000, "allocated": 3000000, "reservable": 4000000},
+                "cpu": {"cores": 8, "systemLoad": rng.random(), "lavalinkLoad": rng.random()},
+                "frameStats": {"sent": 3000, "nulled": 0, "deficit": rng.randint(0, 10)}
+            }))
+        else:
+            frames.append(json.dumps({
+                "op": "playerUpdate",
+                "guildId": str(rng.randint(10 ** 17, 10 ** 18)),
+                "state": {"time": 1500000000000 + i, "position": rng.randint(0, 600000)}
+            }))
+    return frames
+
+
+def make_app(frames):
+    async def handler(request):
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.data == "flood":
+                for frame in frames:
+                    await ws.send_str(frame)
+            elif msg.data == "count":
+                received = 0
+                async for _ in ws:
+                    received += 1
+                    if received == len(frames):
+                        await ws.send_str("done")
+                        break
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    return app
+
+
+async def bench(name, compression, uri, frames):
+    async with aiohttp.ClientSession() as session:
+        transport = get_transport(name)(get_session=lambda: session)
+        transport.compression = compression
+        await transport.connect(uri, {})
+
+        cpu_start = time.process_time()
+        await transport.send("flood")
+        for _ in frames:
+            msg = await transport.recv()
+            assert msg.type == MessageType.TEXT
+
+        await transport.send("count")
+        for frame in frames:
+            await transport.send(frame)
+        await transport.recv()
+        cpu = time.process_time() - cpu_start
+
+        await transport.close()
+    return transport.metrics, cpu
+
+
+async def run(args):
+    frames = make_frames(args.count)
+    runner = web.AppRunner(make_app(frames))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    uri = f"ws://127.0.0.1:{args.port}/"
+    for name in args.transport:
+        settings = [("off", False)]
+        if name == "aiohttp":
+            # aiohttp compresses with a fixed level
+            settings.append(("on", Compression()))
+        else:
+            settings += [(f"level {level}", Compression(level=level)) for level in args.levels]
+
+        for label, compression in settings:
+            metrics, cpu = await bench(name, compression, uri, frames)
+            ratio = metrics.compression_ratio
+            print(f"{name:>10} {label:>8}: negotiated {str(metrics.compressed):>5}, "
+                  f"received {metrics.wire_received / 1024:8.0f} KiB on the wire "
+                  f"for {metrics.payload_received / 1024:8.0f} KiB (ratio {ratio:.2f}), "
+                  f"receive {metrics.receive_time / len(frames) * 1e6:5.1f}us/msg, "
+                  f"send {metrics.send_time / len(frames) * 1e6:5.1f}us/msg, "
+                  f"process CPU {cpu / (2 * len(frames)) * 1e6:5.1f}us/msg")
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=20000, help="The amount of frames in each direction")
+    parser.add_argument("--transport", nargs="+", default=["aiohttp", "websockets"], help="The transports to compare")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9],
+                        help="The compression levels to try, for transports that support them")
+    parser.add_argument("--port", type=int, default=23335, help="The port of the local server")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
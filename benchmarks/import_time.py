@@ -0,0 +1,62 @@
+"""
+Import time guard
+
+Imports `core` in fresh interpreters and fails if it pulls in discord.py, aiohttp or websockets,
+or if it takes longer than the budget on top of asyncio, which every worker needs anyway.
+
+Usage:
+    python -m benchmarks.import_time [--runs 5] [--budget 0.05]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ("discord", "aiohttp", "websockets", "opentelemetry")
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import asyncio
+asyncio_time = time.perf_counter() - start
+start = time.perf_counter()
+import {module}
+core_time = time.perf_counter() - start
+print(json.dumps({{"asyncio": asyncio_time, "core": core_time, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT.format(module=module)], cwd=root)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="The amount of fresh interpreters to measure")
+    parser.add_argument("--budget", type=float, default=0.05, help="The max import time of core in seconds")
+    parser.add_argument("--module", default="core", help="The module to import")
+    args = parser.parse_args()
+
+    results = [measure(args.module) for _ in range(args.runs)]
+    best = min(result["core"] for result in results)
+    print(f"import {args.module}: {best * 1000:.1f}ms (asyncio: {min(r['asyncio'] for r in results) * 1000:.1f}ms)")
+
+    failures = []
+    modules = results[-1]["modules"]
+    for heavy in HEAVY_MODULES:
+        if heavy in modules:
+            failures.append(f"importing {args.module} imported {heavy}")
+    if best > args.budget:
+        failures.append(f"importing {args.module} took {best * 1000:.1f}ms, the budget is {args.budget * 1000:.1f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
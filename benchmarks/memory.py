@@ -0,0 +1,206 @@
+"""
+Memory footprint regression suite for links, players and tracks
+
+Creates N links/players/playlists against a fake bot and node, reports the
+bytes per object and the memory still retained after every link is destroyed.
+
+Usage:
+    python -m benchmarks.memory [-n 10000] [--record] [--tolerance 0.10]
+
+Exits with a non-zero status when a link leaks (stays in `Lavalink.links` or
+`Node.links`) or when a footprint grows past the recorded baseline. The
+footprints are only compared against a baseline recorded with the same
+count, tracks per playlist and interning.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+from core import Lavalink, AudioTrackPlaylist
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "memory_baseline.json")
+WORKLOAD = ("count", "tracks", "intern")
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeBot:
+    def __init__(self, user_id):
+        self.user = FakeUser(user_id)
+        self.shard_id = None
+
+
+class FakeNode:
+    """
+    Stands in for a connected Node, it only swallows whatever gets sent to it
+    """
+    def __init__(self, name):
+        self.name = name
+        self.links = {}
+        self.stats = None
+        self.connected = True
+        self.sent = 0
+
+    async def send(self, msg):
+        self.sent += 1
+
+    async def send_batch(self, msgs):
+        self.sent += len(msgs)
+
+    def links_changed(self, delta):
+        pass
+
+    def publish_load(self):
+        pass
+
+
+def fake_results(index, size):
+    tracks = []
+    for i in range(size):
+        tracks.append({
+            "track": f"QAAAjQIAJVJpY2sgQXN0bGV5IC0g{index:08d}{i:04d}==",
+            "info": {
+                "identifier": f"dQw4w9WgXc{i}",
+                "isSeekable": True,
+                "author": f"Author {index}",
+                "length": 212000 + i,
+                "isStream": False,
+                "position": 0,
+                "title": f"Title {index} - {i}",
+                "uri": f"https://www.youtube.com/watch?v=dQw4w9WgXc{i}"
+            }
+        })
+    return {
+        "loadType": "SEARCH_RESULT",
+        "playlistInfo": {},
+        "tracks": tracks
+    }
+
+
+def measure(before):
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    return current - before
+
+
+async def fill(report, start, lavalink, node, bot, count, tracks_per_playlist):
+    """
+    Creates the links, players and playlists, measures them and destroys the links again
+
+    Everything is created in here so that nothing is still referenced by a local once it returns.
+    """
+    before = measure(start)
+    links = []
+    for guild_id in range(count):
+        link = lavalink.get_link(guild_id, bot)
+        await link.change_node(node)
+        links.append(link)
+    report["bytes_per_link"] = (measure(start) - before) / count
+
+    before = measure(start)
+    players = [link.player for link in links]
+    report["bytes_per_player"] = (measure(start) - before) / count
+
+    before = measure(start)
+    # Every guild loads the same popular songs, like they do in practice
+    playlists = [AudioTrackPlaylist(fake_results(i % 100, tracks_per_playlist), lavalink.track_interner)
+                 for i in range(count)]
+    report["bytes_per_playlist"] = (measure(start) - before) / count
+    report["bytes_per_track"] = report["bytes_per_playlist"] / tracks_per_playlist
+
+    for link in links:
+        await link.destroy()
+
+
+async def run(count, tracks_per_playlist, intern=False):
+    report = {"count": count, "tracks": tracks_per_playlist, "intern": intern}
+    bot = FakeBot(1)
+
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+
+    lavalink = Lavalink(bot.user.id, 1, intern_tracks=intern)
+    node = FakeNode("memory")
+    lavalink.nodes[node.name] = node
+
+    await fill(report, start, lavalink, node, bot, count, tracks_per_playlist)
+
+    report["retained_bytes"] = measure(start)
+    report["leaked_links"] = len(lavalink.links)
+    report["leaked_node_links"] = len(node.links)
+
+    del lavalink, node
+    report["retained_bytes_after_teardown"] = measure(start)
+    tracemalloc.stop()
+    return report
+
+
+def compare(report, baseline, tolerance):
+    failures = []
+    if report["leaked_links"]:
+        failures.append(f"{report['leaked_links']} links never left Lavalink.links")
+    if report["leaked_node_links"]:
+        failures.append(f"{report['leaked_node_links']} links never left Node.links")
+
+    # The footprints depend on the workload, they can only be compared against a baseline of the same one
+    workload = {key: baseline[key] for key in WORKLOAD if key in baseline}
+    if any(report[key] != value for key, value in workload.items()):
+        return failures
+
+    for key, recorded in baseline.items():
+        if not key.startswith("bytes_per_") and not key.startswith("retained_"):
+            continue
+        limit = recorded * (1 + tolerance)
+        if report.get(key, 0) > limit:
+            failures.append(f"{key} grew from {recorded:.0f} to {report[key]:.0f} (limit {limit:.0f})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=10000, help="The amount of links/players/playlists")
+    parser.add_argument("-t", "--tracks", type=int, default=10, help="The amount of tracks per playlist")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed growth over the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Path to the recorded baseline")
+    parser.add_argument("--intern", action="store_true", help="Share the track info between guilds")
+    parser.add_argument("--record", action="store_true", help="Record the results as the new baseline")
+    args = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(run(args.count, args.tracks, args.intern))
+    for key, value in report.items():
+        if key not in WORKLOAD:
+            print(f"{key:>32}: {value:,.1f}")
+
+    if args.record:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print(f"Recorded baseline to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print("No baseline recorded, only checking for leaks")
+    if any(baseline.get(key, report[key]) != report[key] for key in WORKLOAD):
+        recorded = ", ".join(f"{key}={baseline.get(key)}" for key in WORKLOAD)
+        print(f"The baseline was recorded with {recorded}, only checking for leaks")
+
+    failures = compare(report, baseline, args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
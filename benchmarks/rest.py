@@ -0,0 +1,149 @@
+"""
+REST benchmark for `Node.get_tracks`
+
+Serves `/loadtracks` from a local aiohttp server and fires requests at it through a Node,
+reporting throughput, latency, queue time and how many HTTP connections were opened versus reused.
+Afterwards it checks that a half open REST circuit recovers when its probe request gets a body that
+isn't valid JSON.
+
+Usage:
+    python -m benchmarks.rest [-n 2000] [-c 64] [--max-concurrent 16] [--delay 0.005]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from core.circuit_breaker import BreakerState, CircuitBreaker
+from core.exceptions import NodeException
+from core.miscellaneous import SampleWindow
+from core.nodeaio import Node
+
+RESULTS = {
+    "loadType": "SEARCH_RESULT",
+    "playlistInfo": {},
+    "tracks": []
+}
+
+
+def make_app(delay, server):
+    async def load_tracks(request):
+        if delay:
+            await asyncio.sleep(delay)
+        if server["malformed"]:
+            return web.Response(text="{not json", content_type="application/json")
+        return web.json_response(RESULTS)
+
+    app = web.Application()
+    app.router.add_get("/loadtracks", load_tracks)
+    return app
+
+
+def make_trace_config(counters):
+    async def on_create(session, context, params):
+        counters["created"] += 1
+
+    async def on_reuse(session, context, params):
+        counters["reused"] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_create)
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    return trace_config
+
+
+async def check_breaker_probe(port, server):
+    """
+    Drive a half open circuit's probe through a malformed body, the circuit must still recover afterwards
+    :return: A list of failures
+    """
+    failures = []
+    breaker = CircuitBreaker(open_timeout=0.05)
+    node = Node(None, "probe", "127.0.0.1", port, {"Authorization": "bench"}, breaker=breaker)
+
+    breaker.record_failure(retry_after=0.05)
+    await asyncio.sleep(0.06)
+    server["malformed"] = True
+    try:
+        await node.get_tracks("ytsearch:probe", tries=1)
+        failures.append("a malformed body didn't raise a NodeException")
+    except NodeException:
+        pass
+
+    await asyncio.sleep(breaker.retry_in + 0.01)
+    server["malformed"] = False
+    try:
+        await node.get_tracks("ytsearch:probe", tries=1)
+    except NodeException as e:
+        failures.append(f"the circuit didn't recover after a malformed probe: {e.msg}")
+    if breaker.state != BreakerState.CLOSED:
+        failures.append(f"the circuit is {breaker.state.name} after a successful probe")
+
+    await node.close()
+    print(f"half open probe with a malformed body: {'ok' if not failures else 'FAIL'}")
+    return failures
+
+
+async def run(args):
+    server = {"malformed": False}
+    runner = web.AppRunner(make_app(args.delay, server))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+
+    counters = {"created": 0, "reused": 0}
+    node = Node(None, "bench", "127.0.0.1", args.port, {"Authorization": "bench"},
+                max_concurrent_requests=args.max_concurrent, trace_configs=[make_trace_config(counters)])
+
+    latency = SampleWindow(args.requests)
+    pending = iter(range(args.requests))
+
+    async def worker():
+        for _ in pending:
+            start = time.perf_counter()
+            await node.get_tracks("ytsearch:benchmark")
+            latency.add(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    await node.close()
+    failures = await check_breaker_probe(args.port, server)
+    await runner.cleanup()
+
+    print(f"{args.requests} requests in {elapsed:.2f}s ({args.requests / elapsed:,.0f} req/s)")
+    print(f"latency: {format_summary(latency.summary())}")
+    print(f"queue time: {format_summary(node.limiter.queue_time.summary())}")
+    print(f"peak waiting: {node.limiter.peak_waiting}")
+    print(f"connections created: {counters['created']}, reused: {counters['reused']}")
+    return counters, failures
+
+
+def format_summary(summary):
+    return ", ".join(f"{k}={v * 1000:.2f}ms" if k != "count" else f"{k}={v}" for k, v in summary.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="The amount of requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=64, help="The amount of concurrent callers")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="The Node's max concurrent requests")
+    parser.add_argument("--delay", type=float, default=0.005, help="Simulated server latency in seconds")
+    parser.add_argument("--port", type=int, default=23330, help="The port of the local server")
+    args = parser.parse_args()
+
+    counters, failures = asyncio.get_event_loop().run_until_complete(run(args))
+    if counters["created"] > args.max_concurrent:
+        failures.append("more connections were opened than requests may run concurrently")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
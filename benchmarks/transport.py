@@ -0,0 +1,105 @@
+"""
+Websocket transport benchmark
+
+Runs a local websocket server and measures how fast each Transport receives and sends
+Lavalink-like frames, optionally on uvloop.
+
+Usage:
+    python -m benchmarks.transport [-n 50000] [--transport aiohttp websockets] [--uvloop]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from core.transport import MessageType, get_transport
+
+FRAME = json.dumps({
+    "op": "playerUpdate",
+    "guildId": "123456789012345678",
+    "state": {"time": 1500000000000, "position": 60000}
+})
+
+
+def make_app(count):
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.data == "flood":
+                for _ in range(count):
+                    await ws.send_str(FRAME)
+            elif msg.data == "count":
+                received = 0
+                async for _ in ws:
+                    received += 1
+                    if received == count:
+                        await ws.send_str("done")
+                        break
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    return app
+
+
+async def bench_transport(name, uri, count):
+    async with aiohttp.ClientSession() as session:
+        transport = get_transport(name)(get_session=lambda: session)
+        await transport.connect(uri, {})
+
+        await transport.send("flood")
+        start = time.perf_counter()
+        for _ in range(count):
+            msg = await transport.recv()
+            assert msg.type == MessageType.TEXT
+            json.loads(msg.data)
+        recv_elapsed = time.perf_counter() - start
+
+        await transport.send("count")
+        start = time.perf_counter()
+        for _ in range(count):
+            await transport.send(FRAME)
+        await transport.recv()
+        send_elapsed = time.perf_counter() - start
+
+        await transport.close()
+    return recv_elapsed, send_elapsed
+
+
+async def run(args):
+    runner = web.AppRunner(make_app(args.count))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    uri = f"ws://127.0.0.1:{args.port}/"
+    for name in args.transport:
+        recv_elapsed, send_elapsed = await bench_transport(name, uri, args.count)
+        print(f"{name:>12}: recv {args.count / recv_elapsed:>10,.0f} msg/s, send {args.count / send_elapsed:>10,.0f} msg/s")
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--count", type=int, default=50000, help="The amount of frames in each direction")
+    parser.add_argument("--transport", nargs="+", default=["aiohttp", "websockets"], help="The transports to compare")
+    parser.add_argument("--uvloop", action="store_true", help="Run on uvloop")
+    parser.add_argument("--port", type=int, default=23334, help="The port of the local server")
+    args = parser.parse_args()
+
+    if args.uvloop:
+        import uvloop
+        uvloop.install()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,4 +9,10 @@ from .lavalink import *
 from .player import *
 from .miscellaneous import *
 from .nodeaio import *
+from .tracing import *
+from .hedging import *
+from .track_queue import *
+from .stats import *
+from .log_sampling import *
+from .admission import *
 
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+
+from .exceptions import IllegalAction
+
+
+class BotAdapter(ABC):
+    """
+    Everything Magma needs from the Discord library, so the rest of the core doesn't depend on one
+    """
+    @abstractmethod
+    def user_id(self, bot):
+        pass
+
+    @abstractmethod
+    def check_can_connect(self, link, channel):
+        """
+        Raise if the bot can't join the voice channel
+        """
+        pass
+
+    @abstractmethod
+    async def update_voice_state(self, link, channel_id):
+        """
+        Ask Discord to move the bot into a voice channel, or out of it if channel_id is None
+        """
+        pass
+
+    @abstractmethod
+    async def wait_until_connected(self, link, channel, timeout=10):
+        pass
+
+
+class DiscordAdapter(BotAdapter):
+    """
+    The BotAdapter for discord.py, discord is only imported once it's used
+    """
+    def user_id(self, bot):
+        return bot.user.id
+
+    def check_can_connect(self, link, channel):
+        from discord import InvalidArgument
+        from discord.ext.commands import BotMissingPermissions
+
+        if channel.guild.id != link.guild_id:
+            raise InvalidArgument("The guild of the channel isn't the the same as the link's!")
+        if channel.guild.unavailable:
+            raise IllegalAction("Cannot connect to guild that is unavailable!")
+
+        me = channel.guild.me
+        permissions = me.permissions_in(channel)
+        if (not permissions.connect or len(channel.members) >= channel.user_limit >= 1) and not permissions.move_members:
+            raise BotMissingPermissions(["connect"])
+
+    def _get_shard_socket(self, bot, shard_id):
+        from discord.ext import commands
+
+        if isinstance(bot, commands.AutoShardedBot):
+            try:
+                return bot.shards[shard_id].ws
+            except AttributeError:
+                return bot.shards[shard_id]._parent.ws
+
+        if bot.shard_id is None or bot.shard_id == shard_id:
+            return bot.ws
+
+    async def update_voice_state(self, link, channel_id):
+        # We're using discord's websocket, not lavalink
+        bot = link.bot
+        await self._get_shard_socket(bot, bot.shard_id).voice_state(link.guild_id, channel_id)
+
+    async def wait_until_connected(self, link, channel, timeout=10):
+        me = channel.guild.me
+        start = time.monotonic()
+        while not (me.voice and me.voice.channel):
+            await asyncio.sleep(0.1)
+            if time.monotonic() - start >= timeout:
+                raise IllegalAction("Couldn't connect to the channel within a reasonable timeframe!")
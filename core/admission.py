@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from .exceptions import CapacityExceeded
+from .miscellaneous import SampleWindow
+
+logger = logging.getLogger("magma")
+
+
+class AdmissionController:
+    """
+    Holds new players back while every node is at capacity, instead of making the audio worse for everyone
+
+    Players wait in order of arrival and are let in as players leave or the nodes report more room,
+    they get a CapacityExceeded when the wait takes longer than `queue_timeout`.
+    """
+    def __init__(self, queue_timeout=10, max_queue=None, window=1024):
+        """
+        :param queue_timeout: The max amount of seconds a new player waits for a node, 0 to reject right away
+        :param max_queue: The max amount of waiting players, more are rejected right away, None for no limit
+        :param window: The amount of wait times kept for `wait_times`
+        """
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.waiting = deque()
+        self.wait_times = SampleWindow(window)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def queue_length(self):
+        return len(self.waiting)
+
+    def metrics(self):
+        """
+        Get the numbers to alert on, the wait times are in seconds
+        """
+        return {
+            "queue_length": self.queue_length,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_times": self.wait_times.summary()
+        }
+
+    def wake(self, count=None):
+        """
+        Let waiting players retry, the longest waiting ones first
+
+        :param count: The amount of players to wake, None for all of them
+        """
+        woken = 0
+        for future in self.waiting:
+            if count is not None and woken >= count:
+                break
+            if not future.done():
+                future.set_result(None)
+                woken += 1
+
+    async def admit(self, link):
+        """
+        Get a node with capacity left for a new player, waiting for one if needed
+
+        :param link: The Link that needs a node
+        :return: A Node
+        """
+        load_balancer = link.lavalink.load_balancer
+        try:
+            node = await load_balancer.determine_best_node(link, admit=True)
+        except CapacityExceeded:
+            if not self.queue_timeout or (self.max_queue is not None and len(self.waiting) >= self.max_queue):
+                self.rejected += 1
+                raise
+        else:
+            self.admitted += 1
+            self.wait_times.add(0)
+            return node
+
+        self.queued += 1
+        start = time.monotonic()
+        first = True
+        while True:
+            remaining = start + self.queue_timeout - time.monotonic()
+            if remaining <= 0:
+                self.timed_out += 1
+                raise CapacityExceeded(f"No node had capacity for guild {link.guild_id} within {self.queue_timeout}s")
+
+            future = asyncio.get_event_loop().create_future()
+            # Players that were woken but didn't get in keep their place in line
+            if first:
+                self.waiting.append(future)
+            else:
+                self.waiting.appendleft(future)
+            first = False
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting.remove(future)
+
+            try:
+                node = await load_balancer.determine_best_node(link, admit=True)
+            except CapacityExceeded:
+                continue
+            waited = time.monotonic() - start
+            self.admitted += 1
+            self.wait_times.add(waited)
+            logger.debug("Admitted guild %s after waiting %.2fs", link.guild_id, waited)
+            return node
@@ -0,0 +1,395 @@
+"""
+A broker that shares the node connections between multiple bot processes
+
+One process runs a NodeBroker, which owns the websocket and HTTP connections to every Lavalink node.
+The bot processes connect to it over a Unix socket with `Lavalink.connect_broker`, after which their
+nodes are BrokerNodes and Links and Players work as they always do.
+
+Messages are JSON, one per line. Ops for a guild are forwarded to the node, and the node's player
+updates and events for that guild are routed back to the process that last sent an op for it.
+Stats frames and node state changes are sent to every process.
+"""
+
+import asyncio
+import json
+import logging
+import traceback
+
+from .exceptions import IllegalAction, LavalinkException, NodeException
+from .log_sampling import LogSampler
+from .miscellaneous import ExponentialBackoff
+from .nodeaio import Node
+
+logger = logging.getLogger("magma")
+
+# Track loading results of big playlists don't fit in asyncio's default line limit
+LINE_LIMIT = 2 ** 24
+
+
+def _encode(msg):
+    return json.dumps(msg, separators=(",", ":")).encode() + b"\n"
+
+
+class _BrokeredNode(Node):
+    """
+    A Node owned by the broker, it forwards what it receives to the bot processes
+    """
+    def __init__(self, broker, *args, **kwargs):
+        super().__init__(broker, *args, **kwargs)
+        self.broker = broker
+        self.last_stats = None
+
+    async def on_open(self):
+        logger.info(f"Node connected: {self.name}")
+        self.broker.node_state_changed(self)
+
+    async def on_close(self, code=None, reason=None, connect_again=False):
+        self.closing = False
+        logger.warning(f"Connection to {self.name} closed with code: {code}, reason: {reason}")
+        self.broker.node_state_changed(self)
+        if connect_again:
+            logger.info(f"Attempting to reconnect to {self.name}...")
+            await self.connect()
+
+    async def on_message(self, msg):
+        if msg.get("op") == "stats":
+            await super().on_message(msg)
+            self.last_stats = msg
+        self.broker.route(self, msg)
+
+
+class _ClientConnection:
+    def __init__(self, writer):
+        self.writer = writer
+        self.guilds = set()
+
+    def write(self, msg):
+        if not self.writer.is_closing():
+            self.writer.write(_encode(msg))
+
+
+class NodeBroker:
+    """
+    Owns the connections to the Lavalink nodes on behalf of multiple bot processes
+    """
+    def __init__(self, user_id, shard_count, path, log_sampler=None):
+        """
+        :param user_id: The id of the bot user
+        :param shard_count: The total amount of shards over all processes
+        :param path: The path of the Unix socket the bot processes connect to
+        :param log_sampler: The LogSampler for the nodes' websocket payloads
+        """
+        self.user_id = user_id
+        self.shard_count = shard_count
+        self.path = path
+        self.nodes = {}
+        self.owners = {}
+        self.clients = set()
+        self.server = None
+        self.stats_board = None
+        self.admission = None
+        self.log_sampler = log_sampler or LogSampler()
+
+    async def add_node(self, name, host, port, password, **options):
+        """
+        Add a Lavalink node, the options are the same as for `Lavalink.add_node`
+        """
+        headers = {
+            "Authorization": password,
+            "Num-Shards": self.shard_count,
+            "User-Id": self.user_id
+        }
+        node = _BrokeredNode(self, name, host, port, headers, **options)
+        self.nodes[name] = node
+        await node.connect()
+        return node
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._handle_client, self.path, limit=LINE_LIMIT)
+        logger.info(f"Node broker listening on {self.path}")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for node in self.nodes.values():
+            await node.close()
+        for client in list(self.clients):
+            client.writer.close()
+
+    def _node_info(self, node):
+        return {"name": node.name, "connected": bool(node.connected), "stats": node.last_stats}
+
+    def on_node_failed(self, node):
+        # Nothing waits for a quorum of the broker's nodes, the failure is logged by the node
+        pass
+
+    def node_state_changed(self, node):
+        msg = {"t": "node", "node": self._node_info(node)}
+        for client in self.clients:
+            client.write(msg)
+
+    def route(self, node, msg):
+        """
+        Send a message from a node to the process that owns its guild, or to all of them if it has none
+        """
+        wrapped = {"t": "message", "node": node.name, "msg": msg}
+        guild_id = msg.get("guildId")
+        if guild_id is None:
+            for client in self.clients:
+                client.write(wrapped)
+            return
+
+        owner = self.owners.get(str(guild_id))
+        if owner:
+            owner.write(wrapped)
+        else:
+            logger.debug("Dropping a message for guild %s, no process owns it", guild_id)
+
+    async def _handle_client(self, reader, writer):
+        client = _ClientConnection(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    await self._handle(client, json.loads(line))
+                except (ValueError, KeyError, TypeError, AttributeError, LavalinkException) as e:
+                    # A malformed message or one the node couldn't take only fails that message
+                    error = e.msg if isinstance(e, LavalinkException) else repr(e)
+                    logger.warning(f"Failed to handle a broker message: {error}")
+                    client.write({"t": "error", "error": error})
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(client)
+            for guild_id in client.guilds:
+                if self.owners.get(guild_id) is client:
+                    del self.owners[guild_id]
+            writer.close()
+
+    async def _handle(self, client, msg):
+        kind = msg.get("t")
+        if kind == "hello":
+            client.write({"t": "nodes", "nodes": [self._node_info(node) for node in self.nodes.values()]})
+        elif kind == "subscribe":
+            # A process that reconnected takes its guilds back
+            for guild_id in msg["guilds"]:
+                self.owners[guild_id] = client
+                client.guilds.add(guild_id)
+        elif kind == "send":
+            await self._forward(client, msg["node"], msg["payloads"])
+        elif kind == "load":
+            asyncio.ensure_future(self._load(client, msg))
+        else:
+            logger.warning(f"Received unknown broker message: {kind}")
+
+    async def _forward(self, client, node_name, payloads):
+        for payload in payloads:
+            guild_id = payload.get("guildId")
+            if guild_id is None:
+                continue
+            guild_id = str(guild_id)
+            if payload.get("op") == "destroy":
+                self.owners.pop(guild_id, None)
+                client.guilds.discard(guild_id)
+            else:
+                self.owners[guild_id] = client
+                client.guilds.add(guild_id)
+
+        node = self.nodes.get(node_name)
+        if not (node and node.connected):
+            logger.warning(f"Dropping {len(payloads)} messages for {node_name}, it isn't connected")
+            return
+        await node.send_batch(payloads)
+
+    async def _load(self, client, msg):
+        reply = {"t": "loaded", "id": msg["id"], "result": None, "error": None}
+        try:
+            reply["result"] = await self.nodes[msg["node"]].get_tracks(msg["query"])
+        except Exception as e:
+            reply["error"] = str(e)
+        client.write(reply)
+
+
+class BrokerNode(Node):
+    """
+    A Node in a bot process that talks to the real node through the broker
+    """
+    def __init__(self, lavalink, name, client):
+        super().__init__(lavalink, name, "broker", 0, {"Authorization": ""}, heartbeat_interval=None)
+        self.client = client
+        self.remote_connected = False
+
+    @property
+    def connected(self):
+        return self.remote_connected and self.client.connected
+
+    async def connect(self):
+        if self.connected:
+            await self.on_open()
+
+    async def disconnect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send(self, msg):
+        await self.send_batch([msg])
+
+    async def send_batch(self, msgs):
+        if not self.connected:
+            raise NodeException(f"{self.name} isn't connected to the broker")
+        await self.client.send({"t": "send", "node": self.name, "payloads": msgs})
+
+    async def get_tracks(self, query, tries=5, retry_on_failure=True):
+        try:
+            results = await self.client.load(self.name, query)
+        except (NodeException, asyncio.TimeoutError):
+            self.route_planner.record_load(False)
+            raise
+        self.route_planner.record_load(bool(results) and results.get("loadType") != "LOAD_FAILED")
+        return results
+
+
+class BrokerClient:
+    """
+    The connection of a bot process to the NodeBroker, it reconnects when the broker goes away
+    """
+    def __init__(self, lavalink, path, load_timeout=30):
+        self.lavalink = lavalink
+        self.path = path
+        self.load_timeout = load_timeout
+        self.nodes = {}
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.closed = False
+        self._requests = {}
+        self._next_id = 0
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        """
+        Connect to the broker and register its nodes with the Lavalink instance
+        """
+        await self._open()
+        self.read_task = asyncio.ensure_future(self._run())
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+        await self.send({"t": "hello"})
+        reply = json.loads(await self.reader.readline())
+        if reply.get("t") != "nodes":
+            raise IllegalAction(f"Unexpected reply from the broker: {reply}")
+
+        guilds = [str(guild_id) for node in self.nodes.values() for guild_id in node.links]
+        if guilds:
+            # The broker only sends a guild's events to the process that owns it
+            await self.send({"t": "subscribe", "guilds": guilds})
+
+        for info in reply["nodes"]:
+            node = self.nodes.get(info["name"])
+            if not node:
+                node = BrokerNode(self.lavalink, info["name"], self)
+                self.nodes[node.name] = node
+                self.lavalink.nodes[node.name] = node
+            await self._update_node(node, info)
+
+    async def _run(self):
+        backoff = ExponentialBackoff(5, integral=True)
+        while not self.closed:
+            await self._read()
+            while not self.closed:
+                delay = backoff.delay()
+                logger.info(f"Reconnecting to the broker at {self.path} in {delay}s")
+                await asyncio.sleep(delay)
+                try:
+                    await self._open()
+                except (OSError, ValueError, IllegalAction) as e:
+                    logger.warning(f"Failed to reconnect to the broker at {self.path}: {e!r}")
+                else:
+                    logger.info(f"Reconnected to the broker at {self.path}")
+                    break
+
+    async def close(self):
+        self.closed = True
+        if self.writer:
+            self.writer.close()
+
+    async def send(self, msg):
+        self.writer.write(_encode(msg))
+        await self.writer.drain()
+
+    async def load(self, node_name, query):
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_event_loop().create_future()
+        self._requests[request_id] = future
+        try:
+            await self.send({"t": "load", "id": request_id, "node": node_name, "query": query})
+            reply = await asyncio.wait_for(future, self.load_timeout)
+        finally:
+            self._requests.pop(request_id, None)
+
+        if reply["error"]:
+            raise NodeException(reply["error"])
+        return reply["result"]
+
+    async def _update_node(self, node, info):
+        if info["stats"]:
+            await node.on_message(info["stats"])
+        was_connected = node.remote_connected
+        node.remote_connected = info["connected"]
+        if node.remote_connected and not was_connected:
+            await node.on_open()
+        elif was_connected and not node.remote_connected:
+            await node.on_close(reason="Disconnected from the broker")
+
+    async def _read(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    await self._dispatch(json.loads(line))
+                except Exception:
+                    traceback.print_exc()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if not self.closed:
+                logger.warning(f"Lost the connection to the broker at {self.path}")
+            self.writer.close()
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(NodeException("Lost the connection to the broker"))
+            for node in self.nodes.values():
+                if node.remote_connected:
+                    node.remote_connected = False
+                    await node.on_close(reason="Lost the connection to the broker")
+
+    async def _dispatch(self, msg):
+        kind = msg.get("t")
+        if kind == "message":
+            node = self.nodes.get(msg["node"])
+            if node:
+                await node.on_message(msg["msg"])
+        elif kind == "node":
+            node = self.nodes.get(msg["node"]["name"])
+            if node:
+                await self._update_node(node, msg["node"])
+        elif kind == "loaded":
+            future = self._requests.get(msg["id"])
+            if future and not future.done():
+                future.set_result(msg)
+        elif kind == "error":
+            logger.warning(f"The broker couldn't handle a message: {msg['error']}")
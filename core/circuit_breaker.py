@@ -0,0 +1,159 @@
+import logging
+import time
+from collections import deque
+from enum import Enum
+
+from .exceptions import NodeException
+
+logger = logging.getLogger("magma")
+
+
+class BreakerState(Enum):
+    # States the CircuitBreaker can be in
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header
+    :param value: The header, either in seconds or an HTTP date
+    :return: The amount of seconds to wait, None if it's missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a node's REST endpoint once too many of them fail
+
+    The breaker opens when the error rate within the window passes the threshold, or when the node
+    asks us to back off with a Retry-After header. After the open timeout it lets a few probe requests
+    through, closing again if they succeed and reopening with a doubled timeout if they don't.
+    """
+    def __init__(self, error_threshold=0.5, min_requests=5, window=30, open_timeout=5, max_open_timeout=120,
+                 half_open_probes=1):
+        """
+        :param error_threshold: The error rate from 0-1 that opens the breaker
+        :param min_requests: The amount of requests needed within the window before the error rate counts
+        :param window: The amount of seconds the error rate is calculated over
+        :param open_timeout: How long the breaker stays open the first time, in seconds
+        :param max_open_timeout: The upper bound of the open timeout
+        :param half_open_probes: The amount of concurrent probe requests while half open
+        """
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.half_open_probes = half_open_probes
+
+        self._state = BreakerState.CLOSED
+        self._outcomes = deque()
+        self._failures = 0
+        self._current_timeout = open_timeout
+        self._open_until = 0
+        self._probes = 0
+
+    @property
+    def state(self):
+        if self._state == BreakerState.OPEN and time.monotonic() >= self._open_until:
+            self._state = BreakerState.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def is_available(self):
+        """
+        If a request would currently be let through
+        """
+        state = self.state
+        return state == BreakerState.CLOSED or (state == BreakerState.HALF_OPEN and
+                                                 self._probes < self.half_open_probes)
+
+    @property
+    def retry_in(self):
+        """
+        The amount of seconds until the breaker half opens, 0 if it isn't open
+        """
+        if self.state != BreakerState.OPEN:
+            return 0
+        return self._open_until - time.monotonic()
+
+    @property
+    def error_rate(self):
+        self._trim()
+        if not self._outcomes:
+            return 0
+        return self._failures / len(self._outcomes)
+
+    def acquire(self, name="node"):
+        """
+        Reserve a request, raises a NodeException if the breaker doesn't allow it
+        """
+        state = self.state
+        if state == BreakerState.OPEN:
+            raise NodeException(f"The REST circuit of {name} is open, retry in {self.retry_in:.2f}s")
+        if state == BreakerState.HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                raise NodeException(f"The REST circuit of {name} is half open and already probing")
+            self._probes += 1
+
+    def release(self):
+        """
+        Give back a reserved request that never got an outcome, such as a cancelled one
+        """
+        if self._state == BreakerState.HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def record_success(self):
+        if self._state == BreakerState.HALF_OPEN:
+            logger.info("Probe request succeeded, closing the REST circuit")
+            self._state = BreakerState.CLOSED
+            self._current_timeout = self.open_timeout
+            self._outcomes.clear()
+            self._failures = 0
+        self._add(True)
+
+    def record_failure(self, retry_after=None):
+        """
+        :param retry_after: The amount of seconds the node asked us to wait, if any
+        """
+        self._add(False)
+        if self._state == BreakerState.HALF_OPEN:
+            self._current_timeout = min(self._current_timeout * 2, self.max_open_timeout)
+            self._open(retry_after)
+        elif self._state == BreakerState.CLOSED:
+            if retry_after is not None or (len(self._outcomes) >= self.min_requests and
+                                           self.error_rate >= self.error_threshold):
+                self._open(retry_after)
+
+    def _open(self, retry_after):
+        timeout = retry_after if retry_after is not None else self._current_timeout
+        logger.warning(f"Opening the REST circuit for {timeout:.2f}s, error rate: {self.error_rate:.2f}")
+        self._state = BreakerState.OPEN
+        self._open_until = time.monotonic() + timeout
+
+    def _add(self, ok):
+        self._outcomes.append((time.monotonic(), ok))
+        if not ok:
+            self._failures += 1
+        self._trim()
+
+    def _trim(self):
+        cutoff = time.monotonic() - self.window
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
@@ -1,5 +1,8 @@
+import logging
 from abc import ABC, abstractmethod
 
+logger = logging.getLogger("magma")
+
 
 class Event(ABC):
     """
@@ -100,7 +103,7 @@ class AbstractPlayerEventAdapter(ABC):
 
 class InternalEventAdapter(AbstractPlayerEventAdapter):
     """
-    A default internal EventAdapter that only cares about track_end
+    A default internal EventAdapter that keeps the player's state in sync, it runs before any other adapter
     """
 
     async def track_pause(self, event: TrackPauseEvent):
@@ -110,10 +113,20 @@ class InternalEventAdapter(AbstractPlayerEventAdapter):
         event.player.paused = False
 
     async def track_start(self, event: TrackStartEvent):
-        pass
+        event.player.track_started()
 
     async def track_end(self, event: TrackEndEvent):
-        event.player.reset()
+        player = event.player
+        player.track_ended(event.reason)
+        if player.auto_advance and event.reason == "FINISHED":
+            try:
+                if await player.advance(event.track):
+                    return
+            except Exception:
+                # This runs inside the node's listener, which must keep going
+                logger.exception(f"Failed to advance the queue of {player.link.guild_id}")
+        if player.current is event.track:
+            player.reset()
 
     async def track_exception(self, event: TrackExceptionEvent):
         pass
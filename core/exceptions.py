@@ -10,3 +10,13 @@ class IllegalAction(LavalinkException):
 
 class NodeException(LavalinkException):
     pass
+
+
+class CapacityExceeded(NodeException):
+    pass
+
+
+class TransportException(NodeException):
+    def __init__(self, msg, status=None):
+        super().__init__(msg)
+        self.status = status
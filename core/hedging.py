@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+from .exceptions import NodeException
+
+logger = logging.getLogger("magma")
+
+
+class HedgePolicy:
+    """
+    Hedged track loading: if the primary node hasn't answered within a delay based on its
+    recent latency, the same query is sent to the next best node and the first answer wins.
+
+    The budget caps the extra load, with a budget of 0.1 at most 1 in 10 requests is hedged.
+    """
+    def __init__(self, percentile=95, min_delay=0.05, max_delay=2.0, default_delay=0.5, min_samples=20,
+                 budget=0.1, burst=10):
+        """
+        :param percentile: The percentile of the primary node's REST latency to wait for before hedging
+        :param min_delay: The lower bound of the hedge delay, in seconds
+        :param max_delay: The upper bound of the hedge delay, in seconds
+        :param default_delay: The hedge delay while the node has too few latency samples, in seconds
+        :param min_samples: The amount of latency samples needed before the percentile is used
+        :param budget: The max fraction of requests that may be hedged
+        :param burst: The max amount of hedges that can be saved up
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+        self.tokens = burst
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay_for(self, node):
+        """
+        Get how long to wait for a node before hedging
+        :param node: The primary Node
+        :return: The delay in seconds
+        """
+        if len(node.rest_latency) < self.min_samples:
+            return self.default_delay
+        delay = node.rest_latency.percentile(self.percentile)
+        return max(self.min_delay, min(delay, self.max_delay))
+
+    def _take_token(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def load(self, nodes, query):
+        """
+        Load tracks from the first node, hedging to the second one if it's too slow
+        :param nodes: The candidate Nodes, from the best to the worst
+        :param query: The query to pass to the Node
+        :return: The raw results of the query or None if loading failed, and the amount of nodes that were tried
+        """
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.budget)
+
+        primary = nodes[0]
+        primary_task = asyncio.ensure_future(primary.get_tracks(query))
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.delay_for(primary))
+        except asyncio.CancelledError:
+            # asyncio.wait leaves the task running, nobody would wait for its result anymore
+            primary_task.cancel()
+            raise
+        if done or len(nodes) < 2 or not self._take_token():
+            try:
+                return await primary_task, 1
+            except NodeException as e:
+                logger.warning(e.msg)
+                return None, 1
+
+        self.hedged += 1
+        secondary = nodes[1]
+        logger.debug("Hedging track loading from `%s` to `%s`", primary.name, secondary.name)
+        hedge_task = asyncio.ensure_future(secondary.get_tracks(query))
+        pending = {primary_task, hedge_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() or not task.result():
+                        continue  # the other node may still answer
+                    if task is hedge_task:
+                        self.hedge_wins += 1
+                    return task.result(), 2
+            return None, 2
+        finally:
+            for task in pending:
+                task.cancel()
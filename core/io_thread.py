@@ -0,0 +1,35 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("magma")
+
+
+class IOThread:
+    """
+    A thread running its own event loop, the node connections run on it so they don't compete with the bot's gateway
+    """
+    def __init__(self, name="magma-io"):
+        # This follows the event loop policy, so it's a uvloop if uvloop was installed
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    def stop(self, timeout=5):
+        """
+        Stop the loop and wait for the thread to finish, close the nodes first
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning(f"The I/O thread didn't stop within {timeout}s")
+        else:
+            self.loop.close()
@@ -1,22 +1,24 @@
 import asyncio
+import json
 import logging
 import time
 from enum import Enum
-from typing import Optional
 
-from discord import InvalidArgument
-from discord.ext import commands
-from discord.ext.commands import BotMissingPermissions
-from discord.gateway import DiscordWebSocket
-
-from .exceptions import IllegalAction
+from .exceptions import IllegalAction, NodeException
+from .io_thread import IOThread
 from .load_balancing import LoadBalancer
+from .log_sampling import LogSampler
+from .miscellaneous import SampleWindow
 from .nodeaio import Node
-from .player import Player, AudioTrackPlaylist
+from .player import Player, AudioTrackPlaylist, TrackInterner
+from .tracing import Tracer, Stages
 
 logger = logging.getLogger("magma")
 
 
+SNAPSHOT_VERSION = 1
+
+
 class State(Enum):
     # States the Link can be in
     NOT_CONNECTED = 0
@@ -28,13 +30,40 @@ class State(Enum):
 
 
 class Lavalink:
-    def __init__(self, user_id, shard_count):
+    def __init__(self, user_id, shard_count, tracer=None, hedge_policy=None, intern_tracks=False, adapter=None,
+                 stats_board=None, log_sampler=None, balancing_strategy=None, admission=None, io_thread=False):
         self.user_id = user_id
         self.shard_count = shard_count
         self.loop = asyncio.get_event_loop()
-        self.load_balancer = LoadBalancer(self)
+        self.load_balancer = LoadBalancer(self, strategy=balancing_strategy)
+        self.tracer = tracer or Tracer()
+        self.hedge_policy = hedge_policy
+        self.advance_gaps = SampleWindow()
+        # Shares the track info of the same song between guilds
+        self.track_interner = TrackInterner() if intern_tracks else None
+        self._adapter = adapter
+        # Shares the load of the nodes with the other bot processes on the host
+        self.stats_board = stats_board
+        self.log_sampler = log_sampler or LogSampler()
+        # Queues new players while all nodes are at capacity
+        self.admission = admission
+        # The node connections run on this thread's loop, the events are handled on the bot's loop
+        self.io_thread = IOThread() if io_thread else None
         self.nodes = {}
         self.links = {}
+        self.closing = False
+        self._connect_tasks = set()
+        self._ready_waiters = []
+
+    @property
+    def adapter(self):
+        """
+        The BotAdapter used to talk to Discord, the discord.py one unless another was given
+        """
+        if not self._adapter:
+            from .adapters import DiscordAdapter
+            self._adapter = DiscordAdapter()
+        return self._adapter
 
     @property
     def playing_guilds(self):
@@ -70,7 +99,7 @@ class Lavalink:
         self.links[guild_id] = Link(self, guild_id, bot)
         return self.links[guild_id]
 
-    async def add_node(self, name, host, port, password):
+    async def add_node(self, name, host, port, password, **options):
         """
         Add a Lavalink node
 
@@ -78,25 +107,207 @@ class Lavalink:
         :param host: The web socket URI of the node, ("localhost")
         :param port: The REST URI of the node, ("2333")
         :param password: The password to connect to the node
+        :param options: Keyword arguments passed on to the Node, such as `max_concurrent_requests`
         :return: A node
         """
+        node = self._register_node(name, host, port, password, **options)
+        await node.connect()
+        return node
+
+    async def add_nodes(self, nodes, quorum=1, timeout=None):
+        """
+        Add multiple Lavalink nodes, connecting to all of them at the same time
+
+        The nodes are registered right away, the ones that aren't ready by the time
+        the quorum is reached keep connecting in the background.
+
+        :param nodes: A list of dicts with the arguments of `add_node`
+        :param quorum: The amount of nodes that must be ready before returning, None to wait for all of them
+        :param timeout: The max amount of seconds to wait for the quorum, None to wait forever
+        :return: A list of nodes
+        """
+        added = [self._register_node(**kwargs) for kwargs in nodes]
+        for node in added:
+            task = asyncio.ensure_future(node.connect())
+            task.add_done_callback(self._on_connect_done)
+            self._connect_tasks.add(task)
+
+        await self.wait_ready(len(added) if quorum is None else quorum, timeout)
+        return added
+
+    async def connect_broker(self, path, load_timeout=30):
+        """
+        Use the nodes of a NodeBroker running in another process instead of connecting to them directly
+
+        :param path: The path of the broker's Unix socket
+        :param load_timeout: The max amount of seconds to wait for the broker to load tracks
+        :return: The BrokerClient
+        """
+        from .broker import BrokerClient
+
+        client = BrokerClient(self, path, load_timeout)
+        await client.connect()
+        return client
+
+    async def close(self):
+        """
+        Close the connections to all nodes, and stop the I/O thread if there is one
+
+        The links aren't moved to the remaining nodes while they're being closed as well.
+        """
+        self.closing = True
+        for node in list(self.nodes.values()):
+            await node.close()
+        if self.io_thread:
+            self.io_thread.stop()
+
+    def _register_node(self, name, host, port, password, **options):
         headers = {
             "Authorization": password,
             "Num-Shards": self.shard_count,
             "User-Id": self.user_id
         }
 
-        node = Node(self, name, host, port, headers)
-        await node.connect()
+        if self.io_thread:
+            options.setdefault("io_loop", self.io_thread.loop)
+        node = Node(self, name, host, port, headers, **options)
         self.nodes[name] = node
+        return node
+
+    def _on_connect_done(self, task):
+        self._connect_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Failed to connect to a node: {task.exception()!r}")
+
+    @property
+    def ready_nodes(self):
+        return [node for node in self.nodes.values() if node.connected]
+
+    async def wait_ready(self, quorum=1, timeout=None):
+        """
+        Wait until enough nodes are connected
+
+        :param quorum: The amount of connected nodes to wait for
+        :param timeout: The max amount of seconds to wait, None to wait forever
+        :raises NodeException: When the quorum can't be reached because there aren't enough nodes,
+                               or authentication failed for too many of them
+        """
+        if len(self.ready_nodes) >= quorum:
+            return
+        error = self._quorum_error(quorum)
+        if error:
+            raise error
+
+        waiter = (quorum, self.loop.create_future())
+        self._ready_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            raise NodeException(f"Only {len(self.ready_nodes)}/{quorum} nodes were ready within {timeout}s")
+        finally:
+            if waiter in self._ready_waiters:
+                self._ready_waiters.remove(waiter)
+
+    def on_node_ready(self, node):
+        """
+        Called by a node once it's connected, wakes up whoever waits in `wait_ready`
+        """
+        ready = len(self.ready_nodes)
+        for quorum, future in self._ready_waiters:
+            if ready >= quorum and not future.done():
+                future.set_result(None)
 
-    async def get_best_node(self):
+    def on_node_failed(self, node):
+        """
+        Called by a node when it gave up connecting, fails the waits whose quorum can't be reached anymore
         """
-        Determines the best Node based on penalty calculations
+        for quorum, future in self._ready_waiters:
+            error = self._quorum_error(quorum)
+            if error and not future.done():
+                future.set_exception(error)
+
+    def _quorum_error(self, quorum):
+        failed = [node.name for node in self.nodes.values() if node.auth_failed]
+        if len(self.nodes) - len(failed) >= quorum:
+            return None
+        reason = f", authentication failed for {', '.join(failed)}" if failed else ""
+        return NodeException(f"A quorum of {quorum} nodes can't be reached with {len(self.nodes)} nodes{reason}")
+
+    def snapshot(self, path):
+        """
+        Write the state of all links and players to a JSON lines file, one link per line
 
+        :param path: The path of the file
+        :return: The amount of links written
+        """
+        count = 0
+        with open(path, "w") as f:
+            header = {"version": SNAPSHOT_VERSION, "user_id": self.user_id, "time": time.time()}
+            f.write(json.dumps(header) + "\n")
+            for link in list(self.links.values()):
+                f.write(json.dumps(link.snapshot_state(), separators=(",", ":")) + "\n")
+                count += 1
+        return count
+
+    async def restore(self, path, bot, batch_size=500):
+        """
+        Re-create the links and players from a file written by `snapshot` and resume playing
+
+        The file is read line by line and the links are attached to their nodes in batches,
+        links whose node is gone are moved to the best node.
+
+        :param path: The path of the file
+        :param bot: The bot/shard the links belong to
+        :param batch_size: The amount of links that are attached at once
+        :return: The amount of links restored
+        """
+        count = 0
+        batch = []
+        with open(path) as f:
+            header = json.loads(f.readline())
+            if header.get("version") != SNAPSHOT_VERSION:
+                raise IllegalAction(f"Unsupported snapshot version: {header.get('version')}")
+
+            for line in f:
+                state = json.loads(line)
+                link = self.get_link(state["guild_id"], bot)
+                link.restore_state(state)
+                batch.append((link, state["node"]))
+                if len(batch) >= batch_size:
+                    count += await self._reattach(batch)
+                    batch = []
+        if batch:
+            count += await self._reattach(batch)
+        logger.info(f"Restored {count} links from {path}")
+        return count
+
+    async def _reattach(self, batch):
+        tasks = []
+        for link, node_name in batch:
+            node = self.nodes.get(node_name)
+            if not (node and node.connected):
+                node = await self.get_best_node(link)
+            tasks.append(link.change_node(node))
+
+        restored = 0
+        for (link, _), result in zip(batch, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to restore the link of {link.guild_id}: {result!r}")
+            else:
+                restored += 1
+        return restored
+
+    async def get_best_node(self, link=None, admit=False):
+        """
+        Determines the best Node with the load balancer's strategy, penalty calculations by default
+
+        :param link: The Link that needs a node, if it's for a specific one
+        :param admit: Only use nodes below their capacity limits, waiting for one if there's an AdmissionController
         :return: A Node
         """
-        return await self.load_balancer.determine_best_node()
+        if admit and self.admission:
+            return await self.admission.admit(link)
+        return await self.load_balancer.determine_best_node(link, admit)
 
 
 class Link:
@@ -122,7 +333,7 @@ class Link:
         self.state = state
 
     async def update_voice(self, data):
-        logger.debug(f"Received voice update data: {data}")
+        logger.debug("Received voice update data: %s", data)
         if not self.guild_id:  # is this even necessary? :thinking:
             raise IllegalAction("Attempted to start audio connection with a guild that doesn't exist")
 
@@ -133,13 +344,16 @@ class Link:
                 "guildId": data["d"]["guild_id"],
                 "sessionId": self.last_session_id
             })
-            node = await self.get_node(True)
-            await node.send(self.last_voice_update)
+            tracer = self.lavalink.tracer
+            tracer.finish(self.guild_id, Stages.VOICE_HANDSHAKE)
+            with tracer.span(self.guild_id, Stages.VOICE_UPDATE):
+                node = await self.get_node(True)
+                await node.send(self.last_voice_update)
             self.set_state(State.CONNECTED)
         else:  # data["t"] == "VOICE_STATE_UPDATE"
 
             # We're selfish and only care about ourselves
-            if int(data["d"]["user_id"]) != self.bot.user.id:
+            if int(data["d"]["user_id"]) != self.lavalink.adapter.user_id(self.bot):
                 return
 
             channel_id = data["d"]["channel_id"]
@@ -151,16 +365,6 @@ class Link:
                 #     await self.destroy()
                 #     print('destroyed')
 
-    def _get_shard_socket(self, shard_id: int) -> Optional[DiscordWebSocket]:
-        if isinstance(self.bot, commands.AutoShardedBot):
-            try:
-                return self.bot.shards[shard_id].ws
-            except AttributeError:
-                return self.bot.shards[shard_id]._parent.ws
-
-        if self.bot.shard_id is None or self.bot.shard_id == shard_id:
-            return self.bot.ws
-
     async def get_tracks(self, query):
         """
         Get a list of AudioTracks from a query
@@ -168,9 +372,37 @@ class Link:
         :param query: The query to pass to the Node
         :return:
         """
-        node = await self.get_node(True)
-        results = await node.get_tracks(query)
-        return AudioTrackPlaylist(results)
+        with self.lavalink.tracer.span(self.guild_id, Stages.GET_TRACKS):
+            nodes = await self._track_loading_nodes()
+            if not nodes:
+                raise NodeException("No node is able to load tracks right now")
+
+            results = None
+            hedge_policy = self.lavalink.hedge_policy
+            if hedge_policy:
+                results, tried = await hedge_policy.load(nodes[:2], query)
+                # A primary that failed before the hedge delay leaves the second node untried
+                nodes = nodes[tried:]
+
+            for node in nodes:
+                if results:
+                    break
+                try:
+                    results = await node.get_tracks(query)
+                except NodeException as e:
+                    # The node's circuit is open, route to the next healthy one
+                    logger.warning(e.msg)
+            return AudioTrackPlaylist(results or {}, self.lavalink.track_interner)
+
+    async def _track_loading_nodes(self):
+        """
+        Get the nodes that may load tracks, the link's own node first if it's healthy
+
+        Loading tracks doesn't start a player, so a link without a node isn't given one here
+        and this doesn't go through admission control.
+        """
+        node = self.node if self.node and self.node.connected else None
+        return await self.lavalink.load_balancer.track_loading_nodes(node)
 
     async def get_tracks_yt(self, query):
         return await self.get_tracks("ytsearch:" + query)
@@ -182,26 +414,69 @@ class Link:
         """
         Gets a Node for the link
 
-        :param select_if_absent: A boolean that indicates if a Node should be created if there is none
+        :param select_if_absent: A boolean that indicates if a Node should be selected if there is none,
+                                 for playing or connecting, the node must have capacity left for a player
         :return: A Node
+        :raises CapacityExceeded: When a node is selected and all of them are at capacity
         """
         if select_if_absent and not (self.node and self.node.connected):
-            await self.change_node(await self.lavalink.get_best_node())
+            with self.lavalink.tracer.span(self.guild_id, Stages.SELECT_NODE):
+                node = await self.lavalink.get_best_node(self, admit=True)
+            await self.change_node(node)
         return self.node
 
+    def snapshot_state(self):
+        """
+        Get the state of the link and its player as something JSON serializable
+        """
+        return {
+            "guild_id": self.guild_id,
+            "node": self.node.name if self.node else None,
+            "state": self.state.value,
+            "session_id": self.last_session_id,
+            "voice_update": self.last_voice_update,
+            "player": self._player.snapshot_state() if self._player else None
+        }
+
+    def restore_state(self, state):
+        """
+        Restore a state from `snapshot_state`, this doesn't send anything to Lavalink
+        """
+        self.state = State(state["state"])
+        self.last_session_id = state["session_id"]
+        self.last_voice_update = state["voice_update"]
+        if state["player"]:
+            self.player.restore_state(state["player"])
+
+    def state_replay(self):
+        """
+        Build the messages that bring a node up to date with this link: the voice update and the player's state
+
+        :return: A list of payloads
+        """
+        replay = []
+        if self.last_voice_update:
+            replay.append(self.last_voice_update)
+        if self._player:
+            replay.extend(self._player.state_replay())
+        return replay
+
     async def change_node(self, node):
         """
-        Change to another node
+        Change to another node, its state is replayed to the new node in one batch without triggering any events
 
         :param node: The Node to change to
         :return:
         """
+        if self.node and self.node is not node and self.node.links.pop(self.guild_id, None):
+            self.node.links_changed(-1)
         self.node = node
-        self.node.links[self.guild_id] = self
-        if self.last_voice_update:
-            await node.send(self.last_voice_update)
-        if self._player:
-            await self._player.node_changed()
+        if self.guild_id not in node.links:
+            node.links[self.guild_id] = self
+            node.links_changed(1)
+        replay = self.state_replay()
+        if replay:
+            await node.send_batch(replay)
     
     async def connect(self, channel):
         """
@@ -210,18 +485,11 @@ class Link:
         :param channel: The voice channel to connect to
         :return:
         """
-        # We're using discord's websocket, not lavalink
-        if channel.guild.id != self.guild_id:
-            raise InvalidArgument("The guild of the channel isn't the the same as the link's!")
-        if channel.guild.unavailable:
-            raise IllegalAction("Cannot connect to guild that is unavailable!")
-
-        me = channel.guild.me
-        permissions = me.permissions_in(channel)
-        if (not permissions.connect or len(channel.members) >= channel.user_limit >= 1) and not permissions.move_members:
-            raise BotMissingPermissions(["connect"])
+        adapter = self.lavalink.adapter
+        adapter.check_can_connect(self, channel)
 
         self.set_state(State.CONNECTING)
+        self.lavalink.tracer.begin(self.guild_id, Stages.VOICE_HANDSHAKE)
         # payload = {
         #     "op": 4,
         #     "d": {
@@ -232,13 +500,8 @@ class Link:
         #     }
         # }
         # await self.bot._connection._get_websocket(self.guild_id).send_as_json(payload)
-        await self._get_shard_socket(self.bot.shard_id).voice_state(self.guild_id, str(channel.id))
-
-        start = time.monotonic()
-        while not (me.voice and me.voice.channel):
-            await asyncio.sleep(0.1)
-            if start-time.monotonic() >= 10:
-                raise IllegalAction("Couldn't connect to the channel within a reasonable timeframe!")
+        await adapter.update_voice_state(self, str(channel.id))
+        await adapter.wait_until_connected(self, channel)
 
     async def disconnect(self):
         """
@@ -258,11 +521,15 @@ class Link:
         # }
         #
         self.set_state(State.DISCONNECTING)
-        await self._get_shard_socket(self.bot.shard_id).voice_state(self.guild_id, None)
+        await self.lavalink.adapter.update_voice_state(self, None)
 
     async def destroy(self):
-        self.lavalink.links.pop(self.guild_id)
+        self.lavalink.links.pop(self.guild_id, None)
+        self.lavalink.tracer.discard(self.guild_id)
+        if self.node:
+            # The link must leave the node even if a player was never created
+            if self.node.links.pop(self.guild_id, None):
+                self.node.links_changed(-1)
         if self._player and self.node:
-            self.node.links.pop(self.guild_id)
             await self._player.destroy()
             self._player = None
@@ -1,42 +1,241 @@
+import hashlib
 import logging
+import random
+from abc import ABC, abstractmethod
+from bisect import bisect_left
 
-from .exceptions import IllegalAction
+from .exceptions import CapacityExceeded, IllegalAction
+from .stats import NodeLoad
 
 logger = logging.getLogger("magma")
 big_number = 9e30
 
 
+class Strategy(ABC):
+    """
+    Picks the node a link is put on, subclass it and pass it to `Lavalink(..., balancing_strategy=...)`
+    """
+    @abstractmethod
+    async def select(self, lavalink, nodes, link=None):
+        """
+        :param lavalink: The Lavalink instance
+        :param nodes: The connected nodes, never empty
+        :param link: The Link that needs a node, None when it's not for a specific link
+        :return: A Node, None if none of them can take it
+        """
+        pass
+
+
+class PenaltyStrategy(Strategy):
+    """
+    Scores every node with Penalties and picks the lowest, this is Fre_d's algorithm
+    """
+    def __init__(self, penalties=None):
+        """
+        :param penalties: The Penalties class used to score the nodes, a subclass can tune the constants
+        """
+        self.penalties = penalties or Penalties
+
+    async def select(self, lavalink, nodes, link=None):
+        best_node = None
+        record = big_number
+        for node in nodes:
+            total = await self.penalties(node, lavalink).get_total()
+            if total < record:
+                best_node = node
+                record = total
+        return best_node
+
+
+class PowerOfTwoStrategy(PenaltyStrategy):
+    """
+    Scores two random nodes and picks the better one, the decision doesn't get slower with more nodes
+    and the spread is nearly as good as scoring all of them
+    """
+    async def select(self, lavalink, nodes, link=None):
+        if len(nodes) > 2:
+            nodes = random.sample(nodes, 2)
+        return await super().select(lavalink, nodes, link)
+
+
+class LeastPlayingStrategy(Strategy):
+    """
+    Picks the node with the fewest playing players, counting the ones assigned since its last stats frame
+    """
+    async def select(self, lavalink, nodes, link=None):
+        board = lavalink.stats_board
+
+        def playing(node):
+            load = board.load(node) if board else None
+            if load is None:
+                load = NodeLoad.from_node(node)
+            return node.pending_players if load is None else load.playing_players + load.pending
+
+        return min(nodes, key=playing)
+
+
+class ConsistentHashStrategy(Strategy):
+    """
+    Hashes the guild id onto a ring of nodes, so a guild keeps landing on the same node and its caches stay warm
+
+    When a node is gone only its guilds move, to the next node on the ring.
+    """
+    def __init__(self, replicas=100, fallback=None):
+        """
+        :param replicas: The amount of points every node has on the ring, more points spread the guilds more evenly
+        :param fallback: The Strategy used when there is no link to hash, PenaltyStrategy by default
+        """
+        self.replicas = replicas
+        self.fallback = fallback or PenaltyStrategy()
+        self._names = None
+        self._ring = []
+        self._points = []
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def _build(self, names):
+        self._ring = sorted((self._hash(f"{name}-{i}"), name) for name in names for i in range(self.replicas))
+        self._points = [point for point, _ in self._ring]
+        self._names = names
+
+    async def select(self, lavalink, nodes, link=None):
+        if link is None:
+            return await self.fallback.select(lavalink, nodes)
+
+        # The ring holds every node, so guilds don't move around while a node reconnects
+        names = tuple(sorted(lavalink.nodes))
+        if names != self._names:
+            self._build(names)
+
+        available = {node.name: node for node in nodes}
+        start = bisect_left(self._points, self._hash(str(link.guild_id)))
+        for i in range(len(self._ring)):
+            node = available.get(self._ring[(start + i) % len(self._ring)][1])
+            if node:
+                return node
+        return None
+
+
+STRATEGIES = {
+    "penalty": PenaltyStrategy,
+    "power-of-two": PowerOfTwoStrategy,
+    "least-playing": LeastPlayingStrategy,
+    "consistent-hash": ConsistentHashStrategy,
+}
+
+
+def get_strategy(strategy, penalties=None):
+    """
+    Get a Strategy by its name, Strategy instances are returned as is
+
+    :param strategy: The name of a built-in Strategy, a Strategy, or None for PenaltyStrategy
+    :param penalties: The Penalties class the built-in strategies score nodes with
+    """
+    if strategy is None:
+        strategy = "penalty"
+    if not isinstance(strategy, str):
+        return strategy
+
+    try:
+        strategy_class = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown balancing strategy: {strategy}, choose from {', '.join(STRATEGIES)}")
+    if issubclass(strategy_class, PenaltyStrategy):
+        return strategy_class(penalties)
+    if issubclass(strategy_class, ConsistentHashStrategy):
+        return strategy_class(fallback=PenaltyStrategy(penalties))
+    return strategy_class()
+
+
 class LoadBalancer:
 
     """
     The load balancer is copied from Fre_d's Java client, and works in somewhat the same way
+
+    Which node is best is up to its Strategy, Fre_d's penalties by default.
     """
 
-    def __init__(self, lavalink):
+    def __init__(self, lavalink, penalties=None, strategy=None):
+        """
+        :param lavalink: The Lavalink instance
+        :param penalties: The Penalties class used to rank the nodes, a subclass can tune the constants
+        :param strategy: The Strategy or the name of a built-in one, PenaltyStrategy with `penalties` by default
+        """
         self.lavalink = lavalink
+        self.penalties = penalties or Penalties
+        self.strategy = get_strategy(strategy, self.penalties)
+
+    async def has_capacity(self, node):
+        """
+        Check if a node is below its `max_playing_players` and `max_penalty`
+        """
+        if node.max_playing_players is None and node.max_penalty is None:
+            return True
 
-    async def determine_best_node(self):
+        penalties = self.penalties(node, self.lavalink)
+        total = await penalties.get_total()
+        if total >= big_number:
+            # No stats yet, only what was assigned since connecting is known
+            return node.max_playing_players is None or node.pending_players < node.max_playing_players
+        if node.max_penalty is not None and total > node.max_penalty:
+            return False
+        return node.max_playing_players is None or penalties.player_penalty < node.max_playing_players
+
+    async def determine_best_node(self, link=None, admit=False):
+        """
+        :param link: The Link that needs a node, strategies such as ConsistentHashStrategy use its guild
+        :param admit: Only consider nodes with capacity left, for new players
+        :return: A Node
+        """
         nodes = self.lavalink.nodes.values()
         if not nodes:
             raise IllegalAction("No nodes found!")
-        best_node = None
-        record = big_number
-        for node in nodes:
-            penalties = Penalties(node, self.lavalink)
-            total = await penalties.get_total()
-            if total < record:
-                best_node = node
-                record = total
+        available = [node for node in nodes if node.connected]
+        if admit and available:
+            available = [node for node in available if await self.has_capacity(node)]
+            if not available:
+                raise CapacityExceeded("All nodes are at capacity")
+        best_node = await self.strategy.select(self.lavalink, available, link) if available else None
 
         if not best_node or not best_node.connected:
-            raise IllegalAction(f"No available nodes! record: {record}")
+            raise IllegalAction(f"No available nodes! strategy: {type(self.strategy).__name__}")
         return best_node
 
+    async def rank_nodes(self):
+        """
+        Get all available nodes, from the best to the worst
+
+        :return: A list of Nodes
+        """
+        ranked = []
+        for node in self.lavalink.nodes.values():
+            total = await self.penalties(node, self.lavalink).get_total()
+            if total < big_number:
+                ranked.append((total, node))
+        ranked.sort(key=lambda pair: pair[0])
+        return [node for _, node in ranked]
+
+    async def track_loading_nodes(self, preferred=None):
+        """
+        Get the nodes that may load tracks: the ones with a closed REST circuit, the preferred one first.
+        Nodes whose route planner or recent loads show they're being rate limited go last.
+
+        :param preferred: The node to try first if it's healthy, such as the link's own node
+        :return: A list of Nodes
+        """
+        ranked = await self.rank_nodes()
+        if preferred:
+            ranked = [preferred] + [node for node in ranked if node is not preferred]
+        nodes = [node for node in ranked if node.breaker.is_available]
+        # sorted() is stable, so the healthy nodes keep their order
+        return sorted(nodes, key=lambda node: node.route_planner.penalty)
+
     async def on_node_disconnect(self, node):
         logger.info(f"Node disconnected: {node.name}")
-        new_node = await self.determine_best_node()
-        for link in node.links.values():
-            await link.change_node(new_node)
+        for link in list(node.links.values()):
+            await link.change_node(await self.determine_best_node(link))
         node.links = {}
 
     async def on_node_connect(self, node):
@@ -47,6 +246,14 @@ class LoadBalancer:
 
 
 class Penalties:
+    # The CPU penalty grows by CPU_BASE for every percent of system load
+    CPU_BASE = 1.05
+    CPU_WEIGHT = 10
+    # The frame penalties grow by FRAME_BASE for every 6 bad frames per minute
+    FRAME_BASE = 1.03
+    DEFICIT_WEIGHT = 600
+    NULLED_WEIGHT = 600
+
     def __init__(self, node, lavalink):
         self.node = node
         self.lavalink = lavalink
@@ -58,16 +265,29 @@ class Penalties:
 
     async def get_total(self):
         # hard maths
-        stats = self.node.stats
-        if not self.node.connected or not stats:
+        if not self.node.connected:
             return big_number
 
-        self.player_penalty = stats.playing_players
+        # With a stats board the load includes what the other processes on the host assigned
+        load = None
+        board = self.lavalink.stats_board
+        if board:
+            load = board.load(self.node)
+        if load is None:
+            load = NodeLoad.from_node(self.node)
+        if load is None:
+            return big_number
+
+        # Players assigned since the last stats frame count too, so a burst doesn't all land on one node
+        self.player_penalty = max(load.playing_players + load.pending, 0)
+
+        # The smoothed values keep a single noisy frame from swinging the decision
+        self.cpu_penalty = self.CPU_BASE ** (100 * load.system_load) * self.CPU_WEIGHT - self.CPU_WEIGHT
 
-        self.cpu_penalty = 1.05 ** (100 * stats.system_load) * 10 - 10
-        if stats.avg_frame_deficit != -1:
-            self.deficit_frame_penalty = (1.03 ** (500 * (stats.avg_frame_deficit / 3000))) * 600 - 600
-            self.null_frame_penalty = (1.03 ** (500 * (stats.avg_frame_nulled / 3000))) * 300 - 300
-            self.null_frame_penalty *= 2
+        if load.frame_deficit != -1:
+            self.deficit_frame_penalty = self.FRAME_BASE ** (500 * (load.frame_deficit / 3000)) * self.DEFICIT_WEIGHT \
+                - self.DEFICIT_WEIGHT
+            self.null_frame_penalty = self.FRAME_BASE ** (500 * (load.frame_nulled / 3000)) * self.NULLED_WEIGHT \
+                - self.NULLED_WEIGHT
 
         return self.player_penalty + self.cpu_penalty + self.deficit_frame_penalty + self.null_frame_penalty
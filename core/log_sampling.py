@@ -0,0 +1,90 @@
+import logging
+import time
+
+logger = logging.getLogger("magma")
+
+
+class LogSampler:
+    """
+    Decides which websocket payloads get logged at DEBUG level, so it can stay on in production
+
+    Payloads are sampled per op, events per event type, guilds that are being debugged are always
+    logged, and `max_per_second` caps the rest. Nothing is formatted unless it's logged.
+    """
+    def __init__(self, rates=None, default_rate=1, guilds=None, max_per_second=None, structured=False):
+        """
+        :param rates: A dict of op or event type to N, only 1 in N of those payloads is logged, 0 to log none
+        :param default_rate: The N of the ops that aren't in `rates`
+        :param guilds: The ids of the guilds whose payloads are all logged
+        :param max_per_second: The max amount of sampled payloads logged per second, None for no limit
+        :param structured: Log a short message with the fields in `extra["magma"]` instead of the whole payload
+        """
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self.guilds = {str(guild_id) for guild_id in guilds or ()}
+        self.max_per_second = max_per_second
+        self.structured = structured
+        self.dropped = 0
+        self._counters = {}
+        self._tokens = max_per_second
+        self._refilled = time.monotonic()
+
+    def force(self, guild_id):
+        """
+        Log all payloads of a guild
+        """
+        self.guilds.add(str(guild_id))
+
+    def unforce(self, guild_id):
+        self.guilds.discard(str(guild_id))
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_per_second, self._tokens + (now - self._refilled) * self.max_per_second)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def sample(self, kind, guild_id=None):
+        """
+        :param kind: The op of the payload, or the event type for events
+        :param guild_id: The guild of the payload, if any
+        :return: A boolean that indicates if the payload should be logged
+        """
+        if guild_id is not None and self.guilds and str(guild_id) in self.guilds:
+            return True
+
+        rate = self.rates.get(kind, self.default_rate)
+        count = self._counters.get(kind, 0) + 1
+        self._counters[kind] = count
+        if not rate or count % rate or (self.max_per_second and not self._take_token()):
+            self.dropped += 1
+            return False
+        return True
+
+    def log(self, direction, node_name, msg):
+        """
+        Log a payload if it's sampled, callers check `logger.isEnabledFor(logging.DEBUG)` first
+
+        :param direction: "received" or "sent"
+        :param node_name: The name of the node the payload came from or went to
+        :param msg: The payload
+        """
+        op = msg.get("op")
+        kind = msg.get("type", op) if op == "event" else op
+        guild_id = msg.get("guildId")
+        if not self.sample(kind, guild_id):
+            return
+
+        if self.structured:
+            logger.debug("%s %s", direction, kind, extra={"magma": {
+                "direction": direction,
+                "node": node_name,
+                "op": kind,
+                "guild_id": guild_id,
+                "payload": msg
+            }})
+        else:
+            logger.debug("%s websocket message, node `%s`: %s", direction.capitalize(), node_name, msg)
@@ -1,5 +1,88 @@
+import random
 import time
+from collections import deque
 
 
 def format_time(millis):
     return time.strftime('%H:%M:%S', time.gmtime(millis/1000))
+
+
+class ExponentialBackoff:
+    """
+    An exponential backoff with jitter, it behaves like the one in discord.py without depending on it
+    """
+    def __init__(self, base=1, *, integral=False):
+        self._base = base
+        self._exp = 0
+        self._max = 10
+        self._reset_time = base * 2 ** 11
+        self._last_invocation = time.monotonic()
+        self._randfunc = random.randrange if integral else random.uniform
+
+    def delay(self):
+        """
+        Get the next delay, it resets once no delay was needed for a while
+        :return: The delay in seconds
+        """
+        invocation = time.monotonic()
+        interval = invocation - self._last_invocation
+        self._last_invocation = invocation
+
+        if interval > self._reset_time:
+            self._exp = 0
+
+        self._exp = min(self._exp + 1, self._max)
+        return self._randfunc(0, self._base * 2 ** self._exp)
+
+
+class SampleWindow:
+    """
+    Keeps the most recent samples of a measurement to compute a distribution over them
+
+    Samples may be added from the I/O thread, readers work on a copy of the deque, which is taken atomically.
+    """
+    def __init__(self, size=1024):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, pct):
+        """
+        Get a percentile of the recorded samples
+        :param pct: The percentile from 0-100
+        :return: The sample at that percentile, None if nothing was recorded
+        """
+        if not self.samples:
+            return None
+        return self._pick(sorted(self.samples.copy()), pct)
+
+    @staticmethod
+    def _pick(ordered, pct):
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    @property
+    def mean(self):
+        samples = self.samples.copy()
+        if not samples:
+            return None
+        return sum(samples) / len(samples)
+
+    def summary(self):
+        if not self.samples:
+            return {"count": self.count}
+        ordered = sorted(self.samples.copy())
+        return {
+            "count": self.count,
+            "mean": sum(ordered) / len(ordered),
+            "p50": self._pick(ordered, 50),
+            "p95": self._pick(ordered, 95),
+            "p99": self._pick(ordered, 99),
+            "max": ordered[-1],
+        }
+
+    def __len__(self):
+        return len(self.samples)
@@ -22,148 +22,492 @@
 # SOFTWARE.
 
 import asyncio
+import json
 import logging
+import time
 import traceback
 
-import aiohttp
-from discord.backoff import ExponentialBackoff
-
 from . import IllegalAction
+from .circuit_breaker import CircuitBreaker, parse_retry_after
+from .exceptions import NodeException, TransportException
 from .events import TrackEndEvent, TrackStuckEvent, TrackExceptionEvent, TrackStartEvent
+from .miscellaneous import ExponentialBackoff, SampleWindow
+from .route_planner import RoutePlannerHealth
+from .stats import NodeStats, StatsHistory
+from .tracing import Stages
+from .transport import Compression, MessageType, TransportMetrics, get_transport
 
 logger = logging.getLogger("magma")
 logging.getLogger('aiohttp').setLevel(logging.DEBUG)
 
 
-class NodeStats:
-    def __init__(self, msg):
-        self.msg = msg
-
-        self.players = msg.get("players")
-        self.playing_players = msg.get("playingPlayers")
-        self.uptime = msg.get("uptime")
-
-        mem = msg.get("memory")
-        self.mem_free = mem.get("free")
-        self.mem_used = mem.get("used")
-        self.mem_allocated = mem.get("allocated")
-        self.mem_reservable = mem.get("reserveable")
-
-        cpu = msg.get("cpu")
-        self.cpu_cores = cpu.get("cores")
-        self.system_load = cpu.get("systemLoad")
-        self.lavalink_load = cpu.get("lavalinkLoad")
+class RequestLimiter:
+    """
+    Caps the amount of concurrent REST requests to a node, the rest wait their turn in FIFO order
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.queue_time = SampleWindow()
+        self._semaphore = None
+
+    async def __aenter__(self):
+        if not self._semaphore:
+            # Created lazily so it binds to the running loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue_time.add(time.perf_counter() - start)
+        self.active += 1
+        return self
 
-        frames = msg.get("frameStats")
-        if frames:
-            # These are per minute
-            self.avg_frame_sent = frames.get("sent")
-            self.avg_frame_nulled = frames.get("nulled")
-            self.avg_frame_deficit = frames.get("deficit")
-        else:
-            self.avg_frame_sent = -1
-            self.avg_frame_nulled = -1
-            self.avg_frame_deficit = -1
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.active -= 1
+        self._semaphore.release()
 
 
 class Node:
-    def __init__(self, lavalink, name, host, port, headers):
+    def __init__(self, lavalink, name, host, port, headers, connection_limit=100, keepalive_timeout=30,
+                 dns_cache_ttl=300, max_concurrent_requests=16, request_timeout=10, connect_timeout=5,
+                 trace_configs=None, breaker=None, stats_history_size=60, heartbeat_interval=5, missed_pongs=2,
+                 transport="aiohttp", max_playing_players=None, max_penalty=None, route_planner_interval=60,
+                 io_loop=None, compression=None):
+        """
+        :param connection_limit: The max amount of pooled HTTP connections to the node
+        :param keepalive_timeout: How long idle HTTP connections are kept open, in seconds
+        :param dns_cache_ttl: How long resolved addresses are cached, in seconds
+        :param max_concurrent_requests: The max amount of concurrent REST requests, the rest are queued
+        :param request_timeout: The total timeout of a REST request, in seconds
+        :param connect_timeout: The timeout for opening a new HTTP connection, in seconds
+        :param trace_configs: A list of `aiohttp.TraceConfig`s for the REST session
+        :param breaker: The CircuitBreaker guarding the REST endpoint, a default one is used if None
+        :param stats_history_size: The amount of stats frames kept in the node's StatsHistory
+        :param heartbeat_interval: How often the websocket is pinged, in seconds, None to disable it
+        :param missed_pongs: The amount of unanswered pings in a row after which the connection is declared dead
+        :param transport: The websocket Transport, either "aiohttp", "websockets" or a Transport subclass
+        :param max_playing_players: The max amount of playing players, new players go elsewhere once it's reached
+        :param max_penalty: The max penalty total, new players go elsewhere once the node scores higher
+        :param route_planner_interval: How often the node's route planner status is polled, in seconds, None to disable it
+        :param io_loop: The event loop the connections run on, if it's not the bot's, see `Lavalink(io_thread=True)`
+        :param compression: Negotiate permessage-deflate, True or a Compression with its settings,
+                            False to disable it, None for the transport's default
+        """
         self.name = name
         self.lavalink = lavalink
         self.links = {}
         self.headers = {str(k): str(v) for k, v in headers.items()}
         self.stats = None
-        self.session = aiohttp.ClientSession(headers={"Authorization": self.headers["Authorization"]})
+        self.stats_history = StatsHistory(stats_history_size)
+        # Players assigned to the node since its last stats frame
+        self.pending_players = 0
+        self.max_playing_players = max_playing_players
+        self.max_penalty = max_penalty
+        self.route_planner = RoutePlannerHealth()
+        self.route_planner_interval = route_planner_interval
+        self.route_planner_task = None
+        self.io_loop = io_loop
+        self.compression = Compression() if compression is True else compression
+        self.transport_metrics = TransportMetrics()
+        # How long received messages wait for their handler, and commands take to reach the I/O loop, in seconds
+        self.event_handoff = SampleWindow(1024)
+        self.command_handoff = SampleWindow(1024)
+        self._dispatch_queue = None
+        self._dispatch_task = None
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.trace_configs = trace_configs
+        self.limiter = RequestLimiter(max_concurrent_requests)
+        self.rest_latency = SampleWindow(256)
+        self.breaker = breaker or CircuitBreaker()
+        self.session = None
+        self.transport = get_transport(transport)
+        if self.compression:
+            unsupported = self.transport.unsupported_compression(self.compression)
+            if unsupported:
+                logger.warning(f"The {self.transport.__name__} of {name} can't honour the compression settings "
+                               f"{', '.join(unsupported)}, they're ignored")
         self.ws = None
         self.listen_task = None
+        self.heartbeat_interval = heartbeat_interval
+        self.missed_pongs = missed_pongs
+        self.heartbeat_task = None
+        self.rtt = None
+        self.rtt_samples = SampleWindow(128)
+        self._awaiting_pong = None
         # self.available = False
         self.closing = False
+        # The node rejected the password, it won't be connected to again
+        self.auth_failed = False
 
         self.uri = f"ws://{host}:{port}"
         self.rest_uri = f"http://{host}:{port}"
 
     @property
     def connected(self):
-        return self.ws and not self.ws.closed
+        # Read once, the I/O loop may drop the connection in between
+        ws = self.ws
+        return ws is not None and not ws.closed
+
+    def _get_session(self):
+        # The session is created inside the running loop rather than in __init__
+        if not self.session or self.session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": self.headers["Authorization"]},
+                trace_configs=self.trace_configs
+            )
+        return self.session
 
     async def _connect(self):
         backoff = ExponentialBackoff(5, integral=True)
         while not self.connected:
             try:
                 logger.info(f'Attempting to establish websocket connection to {self.name}')
-                self.ws = await self.session.ws_connect(self.uri, headers=self.headers)
-            except aiohttp.ClientConnectorError:
-                logger.warning(f'[{self.name}] Invalid response received; this may indicate that '
-                               'Lavalink is not running, or is running on a port different '
-                               'to the one you passed to `add_node`.')
-            except aiohttp.WSServerHandshakeError as ce:
-                if ce.status in (401, 403):
+                ws = self.transport(get_session=self._get_session)
+                ws.on_pong = self._on_pong
+                ws.compression = self.compression
+                ws.metrics = self.transport_metrics
+                await ws.connect(self.uri, self.headers)
+                self.ws = ws
+            except TransportException as te:
+                if te.status in (401, 403):
                     logger.error(f'Authentication failed when establishing a connection to {self.name}')
+                    self.auth_failed = True
                     return
-
-                logger.warning(f'{self.name} returned a code {ce.status} which was unexpected')
+                elif te.status:
+                    logger.warning(f'{self.name} returned a code {te.status} which was unexpected')
+                else:
+                    logger.warning(f'[{self.name}] Invalid response received; this may indicate that '
+                                   'Lavalink is not running, or is running on a port different '
+                                   'to the one you passed to `add_node`.')
 
             else:
                 logger.info(f'Connection established to {self.name}')
                 self.listen_task = asyncio.create_task(self.listen())
+                if self.heartbeat_interval:
+                    self.heartbeat_task = asyncio.create_task(self._heartbeat(self.ws))
+                if self.route_planner_interval and self.route_planner.supported:
+                    self.route_planner_task = asyncio.create_task(self._poll_route_planner(self.ws))
                 return
 
             delay = backoff.delay()
             logger.error(f"Connection refused, trying again in {delay}s")
             await asyncio.sleep(delay)
 
+    async def _run_io(self, coro):
+        """
+        Run a coroutine on the node's I/O loop and wait for it, or right away if there is no I/O loop
+        """
+        if self.io_loop is None or self.io_loop is asyncio.get_running_loop():
+            return await coro
+        future = asyncio.run_coroutine_threadsafe(self._timed(coro, time.perf_counter()), self.io_loop)
+        return await asyncio.wrap_future(future)
+
+    async def _timed(self, coro, queued_at):
+        self.command_handoff.add(time.perf_counter() - queued_at)
+        return await coro
+
+    async def _dispatch(self, handler, *args, **kwargs):
+        """
+        Run a handler on the bot's loop, in the order they were dispatched
+
+        The handlers run in their own task, so the listener keeps reading frames (and pongs) while a slow
+        handler runs, and a dead connection can be torn down without cancelling a handler halfway.
+        """
+        item = (time.perf_counter(), handler, args, kwargs)
+        if self.io_loop is None:
+            self._enqueue(item)
+        else:
+            self.lavalink.loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item):
+        if self._dispatch_queue is None:
+            self._dispatch_queue = asyncio.Queue()
+            self._dispatch_task = asyncio.ensure_future(self._run_dispatch())
+        self._dispatch_queue.put_nowait(item)
+
+    def _on_bot_loop(self, callback, *args):
+        """
+        Call a function on the bot's loop, the state the load balancer reads is only changed there
+        """
+        if self.io_loop is None:
+            callback(*args)
+        else:
+            self.lavalink.loop.call_soon_threadsafe(callback, *args)
+
+    async def _run_dispatch(self):
+        queue = self._dispatch_queue
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            queued_at, handler, args, kwargs = item
+            self.event_handoff.add(time.perf_counter() - queued_at)
+            try:
+                await handler(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+
     async def connect(self):
-        await self._connect()
-        await self.on_open()
+        await self._run_io(self._connect())
+        if self.connected:
+            await self.on_open()
+        elif self.auth_failed:
+            self.lavalink.on_node_failed(self)
 
     async def disconnect(self):
         logger.info(f"Closing websocket connection for node: {self.name}")
-        await self.ws.close()
+        self.closing = True
+        await self._run_io(self._close_ws())
+
+    async def _close_ws(self):
+        ws = self.ws
+        if ws:
+            await ws.close()
+
+    async def close(self):
+        """
+        Disconnect from the node and close the pooled HTTP connections
+        """
+        if self.connected:
+            await self.disconnect()
+        await self._run_io(self._stop_tasks())
+        if self.session:
+            await self._run_io(self.session.close())
+        await self._stop_dispatch()
+
+    async def _stop_dispatch(self):
+        """
+        Run the handlers that were dispatched already, then stop the dispatch task
+        """
+        if self._dispatch_task:
+            self._dispatch_queue.put_nowait(None)
+            await self._dispatch_task
+            self._dispatch_queue = None
+            self._dispatch_task = None
+
+    async def _stop_tasks(self):
+        for task in (self.heartbeat_task, self.route_planner_task):
+            if task:
+                task.cancel()
+
+    async def _poll_route_planner(self, ws):
+        """
+        Keep track of the addresses the node's route planner marked as failing, while the websocket is open
+        """
+        import aiohttp
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout, connect=self.connect_timeout)
+        while not ws.closed:
+            try:
+                async with self._get_session().get(self.rest_uri + "/routeplanner/status", timeout=timeout) as resp:
+                    if resp.status == 404:
+                        logger.info(f"{self.name} has no route planner endpoint, not polling it anymore")
+                        self.route_planner.supported = False
+                        return
+                    if resp.status == 200:
+                        status = await resp.json()
+                        if not isinstance(status, dict):
+                            raise ValueError(f"Expected a JSON object, received {type(status).__name__}")
+                        self._on_bot_loop(self.route_planner.update, status)
+                    elif resp.status == 204:
+                        self._on_bot_loop(self.route_planner.update, None)
+                    else:
+                        logger.warning(f"Received status code ({resp.status}) from {self.name} "
+                                       f"while polling its route planner")
+            except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+                # ValueError covers a body that isn't valid JSON
+                logger.warning(f"Failed to poll the route planner of {self.name}: {e!r}")
+            await asyncio.sleep(self.route_planner_interval)
+
+    async def _heartbeat(self, ws):
+        """
+        Pings the node to notice half-open connections quickly and to measure the round trip time
+        """
+        self._awaiting_pong = None
+        missed = 0
+        while not ws.closed:
+            if self._awaiting_pong is not None:
+                missed += 1
+                if missed >= self.missed_pongs:
+                    await self._on_heartbeat_timeout(ws, missed)
+                    return
+            else:
+                missed = 0
+
+            self._awaiting_pong = str(time.perf_counter()).encode()
+            try:
+                await ws.ping(self._awaiting_pong)
+            except Exception:
+                pass  # the connection is closing, `listen` takes care of it
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _on_heartbeat_timeout(self, ws, missed):
+        logger.warning(f"{self.name} didn't answer {missed} pings in a row, assuming the connection is dead")
+        if self.listen_task:
+            # It's waiting on a socket that will never receive anything
+            self.listen_task.cancel()
+        # A dead connection won't answer the close frame either, don't wait for it
+        asyncio.ensure_future(ws.close(code=1001))
+        self.ws = None
+        await self._dispatch(self.on_close, reason="Heartbeat timed out", connect_again=True)
+
+    def _on_pong(self, data):
+        if data and data == self._awaiting_pong:
+            self.rtt = time.perf_counter() - float(data)
+            self.rtt_samples.add(self.rtt)
+            self._awaiting_pong = None
 
     async def listen(self):
-        async for msg in self.ws:
-            logger.debug(f"Received websocket message from `{self.name}`: {msg.data}")
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                await self.on_message(msg.json())
-            elif msg.type == aiohttp.WSMsgType.ERROR:
-                exc = self.ws.exception()
-                logger.error(f'Received an error from `{self.name}`: {exc}')
-                await self.on_close(reason=exc)
+        ws = self.ws
+        while True:
+            msg = await ws.recv()
+            if msg.type == MessageType.TEXT:
+                data = json.loads(msg.data)
+                if logger.isEnabledFor(logging.DEBUG):
+                    self.lavalink.log_sampler.log("received", self.name, data)
+                await self._dispatch(self.on_message, data)
+            elif msg.type == MessageType.ERROR:
+                logger.error(f'Received an error from `{self.name}`: {msg.data}')
+                await self._dispatch(self.on_close, reason=msg.data)
                 return
-            elif msg.type in (aiohttp.WSMsgType.CLOSE,
-                                 aiohttp.WSMsgType.CLOSING,
-                                 aiohttp.WSMsgType.CLOSED):
-                logger.info(f'Received close frame from `{self.name}`: {msg.data}')
-                await self.on_close(msg.data, msg.extra)
+            else:
+                logger.info(f'Connection to `{self.name}` closed with code {msg.code}')
+                await self._dispatch(self.on_close, msg.code, msg.reason, connect_again=not self.closing)
                 return
-        await self.on_close(connect_again=True)
 
     async def send(self, msg):
         if not self.connected:
             await self.on_close(connect_again=True)
         # raise NodeException("Websocket is not ready, cannot send message")
 
-        logger.debug(f"Sending websocket message: {msg}")
-        await self.ws.send_json(msg)
+        if logger.isEnabledFor(logging.DEBUG):
+            self.lavalink.log_sampler.log("sent", self.name, msg)
+        await self._run_io(self._send_all([msg]))
+
+    async def send_batch(self, msgs):
+        """
+        Send multiple messages back to back
+        :param msgs: A list of payloads
+        """
+        if not self.connected:
+            await self.on_close(connect_again=True)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for msg in msgs:
+                self.lavalink.log_sampler.log("sent", self.name, msg)
+        await self._run_io(self._send_all(msgs))
+
+    async def _send_all(self, msgs):
+        # Taken on the I/O loop, where a heartbeat timeout may have dropped the connection in the meantime
+        ws = self.ws
+        if ws is None or ws.closed:
+            raise NodeException(f"Lost the connection to {self.name}, {len(msgs)} messages weren't sent")
+        for msg in msgs:
+            await ws.send(json.dumps(msg))
 
     async def get_tracks(self, query, tries=5, retry_on_failure=True):
-        # Fetch tracks from the Lavalink node using its REST API
-        params = {"identifier": query}
+        """
+        Fetch tracks from the Lavalink node using its REST API
+
+        Failed requests are retried with a backoff, or after the delay in a Retry-After header.
+        A NodeException is raised if the node's REST circuit breaker is open, or if the node's answer isn't valid.
+
+        :param query: The query to load
+        :param tries: The max amount of attempts
+        :param retry_on_failure: If failed requests should be retried
+        :return: The raw results, or a falsy value if loading failed
+        """
+        import aiohttp
+        # The requests run on the I/O loop, the breaker and the health of the node are kept on this one
         backoff = ExponentialBackoff(base=1)
+        start = time.perf_counter()
         for attempt in range(tries):
-            async with self.session.get(self.rest_uri + "/loadtracks", params=params) as resp:
-                if resp.status != 200 and retry_on_failure:
-                    retry = backoff.delay()
-                    logger.error(f"Received status code ({resp.status}) while retrieving tracks, retrying in {retry} seconds. Attempt {attempt+1}/{tries}")
-                    continue
-                elif resp.status != 200 and not retry_on_failure:
-                    logger.error(f"Received status code ({resp.status}) while retrieving tracks, not retrying.")
-                    return {}
-                res = await resp.json()
-                return res
+            self.breaker.acquire(self.name)
+            retry_after = None
+            # Every request the breaker let through gets an outcome, or gives its probe back
+            recorded = False
+            try:
+                try:
+                    status, res, retry_after = await self._run_io(self._load_tracks(query))
+                except (ValueError, aiohttp.ContentTypeError) as e:
+                    # The node answered 200 with a body that isn't a JSON object, retrying won't fix that
+                    self.breaker.record_failure()
+                    recorded = True
+                    self.route_planner.record_load(False)
+                    raise NodeException(f"{self.name} returned invalid track loading results: {e!r}") from e
+                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                    logger.error(f"Failed to retrieve tracks from {self.name}: {e!r}. Attempt {attempt+1}/{tries}")
+                    status = None
+
+                if status == 200:
+                    self.breaker.record_success()
+                    recorded = True
+                    self.rest_latency.add(time.perf_counter() - start)
+                    self.route_planner.record_load(res.get("loadType") != "LOAD_FAILED")
+                    return res
+                if status is not None:
+                    logger.error(f"Received status code ({status}) from {self.name} while retrieving "
+                                 f"tracks. Attempt {attempt+1}/{tries}")
+                self.breaker.record_failure(retry_after)
+                recorded = True
+            finally:
+                if not recorded:
+                    self.breaker.release()
+
+            if not retry_on_failure or attempt+1 == tries:
+                break
+            if not self.breaker.is_available:
+                # Don't keep hammering a node that asked us to back off
+                self.route_planner.record_load(False)
+                raise NodeException(f"The REST circuit of {self.name} opened while retrieving tracks")
+
+            delay = retry_after if retry_after is not None else backoff.delay()
+            logger.info(f"Retrying to retrieve tracks from {self.name} in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
+        # One outcome per load, however many attempts it took
+        self.route_planner.record_load(False)
+        return {}
+
+    async def _load_tracks(self, query):
+        """
+        Make a single `/loadtracks` request
+        :return: The status code, the results if it succeeded, and the delay of the Retry-After header
+        """
+        import aiohttp
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout, connect=self.connect_timeout)
+        async with self.limiter:
+            async with self._get_session().get(self.rest_uri + "/loadtracks", params={"identifier": query},
+                                               timeout=timeout) as resp:
+                if resp.status == 200:
+                    res = await resp.json()
+                    if not isinstance(res, dict):
+                        raise ValueError(f"Expected a JSON object, received {type(res).__name__}")
+                    return resp.status, res, None
+                return resp.status, None, parse_retry_after(resp.headers.get("Retry-After"))
 
     async def on_open(self):
-        await self.lavalink.load_balancer.on_node_connect(self)
+        if not self.lavalink.closing:
+            await self.lavalink.load_balancer.on_node_connect(self)
+        self.lavalink.on_node_ready(self)
+        self.capacity_changed()
 
     async def on_close(self, code=None, reason=None, connect_again=False):
         self.closing = False
@@ -176,6 +520,10 @@ class Node:
         else:
             logger.warning(f"Connection to {self.name} closed unexpectedly with code: {code}, reason: {reason}")
 
+        if self.lavalink.closing:
+            # Every node is being shut down, there's nothing to fail over to
+            return
+
         try:
             await self.lavalink.load_balancer.on_node_disconnect(self)
         except IllegalAction:
@@ -185,6 +533,29 @@ class Node:
             logger.info(f"Attempting to reconnect to {self.name}...")
             await self.connect()
 
+    def links_changed(self, delta):
+        """
+        Called when links join or leave the node, so the load balancer knows before the next stats frame
+        """
+        self.pending_players += delta
+        self.publish_load()
+        if delta < 0:
+            self.capacity_changed(-delta)
+
+    def capacity_changed(self, freed=None):
+        """
+        Let players waiting for admission retry
+        :param freed: The amount of players that left, None if the load changed in another way
+        """
+        admission = self.lavalink.admission
+        if admission:
+            admission.wake(freed)
+
+    def publish_load(self):
+        board = self.lavalink.stats_board
+        if board:
+            board.publish(self)
+
     async def on_message(self, msg):
         # We receive Lavalink responses here
         op = msg.get("op")
@@ -194,6 +565,10 @@ class Node:
                 await link.player.provide_state(msg.get("state"))
         elif op == "stats":
             self.stats = NodeStats(msg)
+            self.stats_history.add(self.stats)
+            self.pending_players = 0
+            self.publish_load()
+            self.capacity_changed()
         elif op == "event":
             await self.handle_event(msg)
         else:
@@ -213,6 +588,9 @@ class Node:
             event = TrackEndEvent(player, player.current, msg.get("reason"))
         elif event_type == "TrackStartEvent":
             event = TrackStartEvent(player, player.current)
+            tracer = self.lavalink.tracer
+            tracer.finish(link.guild_id, Stages.TRACK_START)
+            tracer.finish(link.guild_id, Stages.COMMAND)
         elif event_type == "TrackExceptionEvent":
             event = TrackExceptionEvent(player, player.current, msg.get("error"))
         elif event_type == "TrackStuckEvent":
@@ -1,9 +1,13 @@
+import asyncio
 import traceback
+import weakref
 from enum import Enum
 from time import time
 
-from .exceptions import IllegalAction
+from .exceptions import IllegalAction, LavalinkException
 from .events import InternalEventAdapter, TrackPauseEvent, TrackResumeEvent, TrackStartEvent
+from .tracing import Stages
+from .track_queue import TrackQueue, TrackReference, RepeatMode
 
 
 class LoadTypes(Enum):
@@ -24,30 +28,144 @@ class BassModes(Enum):
     SICKO = "SICKO"
 
 
+class TrackInfo:
+    """
+    The immutable information of a track, it can be shared by every AudioTrack of the same song
+    """
+    __slots__ = ("encoded_track", "stream", "uri", "title", "author", "identifier", "seekable", "duration",
+                 "__weakref__")
+
+    def __init__(self, track):
+        info = track['info']
+        set_attr = object.__setattr__
+        set_attr(self, "encoded_track", track['track'])
+        set_attr(self, "stream", info['isStream'])
+        set_attr(self, "uri", info['uri'])
+        set_attr(self, "title", info['title'])
+        set_attr(self, "author", info['author'])
+        set_attr(self, "identifier", info['identifier'])
+        set_attr(self, "seekable", info['isSeekable'])
+        set_attr(self, "duration", info['length'])
+
+    def __setattr__(self, key, value):
+        raise AttributeError("TrackInfo is immutable")
+
+    def replace(self, name, value):
+        """
+        Get a copy of the info with one field changed
+        """
+        info = object.__new__(TrackInfo)
+        for field in TrackInfo.__slots__[:-1]:
+            object.__setattr__(info, field, value if field == name else getattr(self, field))
+        return info
+
+
+def _info_property(name):
+    def get(self):
+        return getattr(self.info, name)
+
+    def set(self, value):
+        # Copy on write, the info may be shared with the tracks of other guilds
+        self.info = self.info.replace(name, value)
+
+    return property(get, set)
+
+
+class TrackInterner:
+    """
+    Hands out one shared TrackInfo per encoded track for as long as any AudioTrack uses it
+    """
+    def __init__(self):
+        self._infos = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, track):
+        """
+        Get the shared TrackInfo of a track
+        :param track: A track in the format Lavalink sends it in
+        :return: A TrackInfo
+        """
+        info = self._infos.get(track['track'])
+        if info is None:
+            info = TrackInfo(track)
+            self._infos[info.encoded_track] = info
+            self.misses += 1
+        else:
+            self.hits += 1
+        return info
+
+    def __len__(self):
+        return len(self._infos)
+
+
 class AudioTrack:
     """
     The base AudioTrack class that is used by the player to play songs
+
+    It's a thin wrapper around a TrackInfo, which is shared between guilds when a TrackInterner is used
     """
-    def __init__(self, track):
-        self.encoded_track = track['track']
-        self.stream = track['info']['isStream']
-        self.uri = track['info']['uri']
-        self.title = track['info']['title']
-        self.author = track['info']['author']
-        self.identifier = track['info']['identifier']
-        self.seekable = track['info']['isSeekable']
-        self.duration = track['info']['length']
+    # __dict__ lets bots keep attributes of their own on tracks, such as who requested them
+    __slots__ = ("info", "user_data", "__dict__")
+
+    def __init__(self, track, interner=None):
+        self.info = interner.intern(track) if interner is not None else TrackInfo(track)
         self.user_data = None
 
+    encoded_track = _info_property("encoded_track")
+    stream = _info_property("stream")
+    uri = _info_property("uri")
+    title = _info_property("title")
+    author = _info_property("author")
+    identifier = _info_property("identifier")
+    seekable = _info_property("seekable")
+    duration = _info_property("duration")
+
+    def to_dict(self):
+        """
+        Get the track in the format Lavalink sends it in
+        """
+        return {
+            "track": self.encoded_track,
+            "info": {
+                "isStream": self.stream,
+                "uri": self.uri,
+                "title": self.title,
+                "author": self.author,
+                "identifier": self.identifier,
+                "isSeekable": self.seekable,
+                "length": self.duration
+            }
+        }
+
+
+def serialize_track(track):
+    """
+    Turn an AudioTrack, TrackReference or query into something JSON serializable, user_data isn't kept
+    """
+    if isinstance(track, str):
+        return {"query": track}
+    if isinstance(track, TrackReference):
+        return {"ref": [track.encoded_track, track.duration, track.seekable, track.stream]}
+    return track.to_dict()
+
+
+def deserialize_track(data, interner=None):
+    if "query" in data:
+        return data["query"]
+    if "ref" in data:
+        return TrackReference(*data["ref"])
+    return AudioTrack(data, interner)
+
 
 class AudioTrackPlaylist:
-    def __init__(self, results):
+    def __init__(self, results, interner=None):
         try:
             self.playlist_info = results["playlistInfo"]
             self.playlist_name = self.playlist_info.get("name")
             self.selected_track = self.playlist_info.get("selectedTrack")
             self.load_type = LoadTypes[results["loadType"]]
-            self.tracks = [AudioTrack(track) for track in results["tracks"]]
+            self.tracks = [AudioTrack(track, interner) for track in results["tracks"]]
         except KeyError:
             raise IllegalAction(f"Results invalid!, received: {results}")
 
@@ -103,6 +221,23 @@ class Player:
         self.bass_mode = BassModes.OFF
         self.update_time = -1
         self._position = -1
+        self._queue = None
+        self.auto_advance = False
+        self._prefetch_task = None
+        self._advance_task = None
+        self._ended_at = None
+
+    @property
+    def queue(self):
+        # Created on first use, most players never queue anything
+        if self._queue is None:
+            self._queue = self._new_queue()
+        return self._queue
+
+    def _new_queue(self, compact=False):
+        queue = TrackQueue(compact=compact)
+        queue.on_head_changed = self._queue_head_changed
+        return queue
 
     @property
     def is_playing(self):
@@ -222,7 +357,7 @@ class Player:
         :param gain: a value from -0.25 to 1
         :return:
         """
-        await self.set_eq((band, gain))
+        await self.set_eq([(band, gain)])
 
     async def set_bass(self, bass_mode):
         """
@@ -249,9 +384,13 @@ class Player:
             "startTime": position,
             "noReplace": no_replace
         }
-        node = await self.link.get_node(True)
-        await node.send(payload)
-        self.update_time = time()*1000
+        tracer = self.link.lavalink.tracer
+        with tracer.span(self.link.guild_id, Stages.PLAY):
+            node = await self.link.get_node(True)
+            await node.send(payload)
+        tracer.begin(self.link.guild_id, Stages.TRACK_START)
+        self.update_time = time()
+        self._position = position
         self.current = track
         # await self.trigger_event(TrackStartEvent(self, track))
 
@@ -281,19 +420,189 @@ class Player:
         if node and node.connected:
             await node.send(payload)
 
+        for task in (self._prefetch_task, self._advance_task):
+            if task:
+                task.cancel()
+        self._prefetch_task = None
+        self._advance_task = None
+
         if self.event_adapter:
             await self.event_adapter.destroy()
             self.event_adapter = None
 
-    async def node_changed(self):
-        if self.current:
-            await self.play(self.current, self._position)
+    async def advance(self, finished=None):
+        """
+        Play the next track in the queue
+
+        A query that wasn't prefetched in time is resolved in the background and played once it's loaded,
+        this is called from the node's listener and loading tracks would hold up all of the node's events.
+
+        :param finished: The track that just finished, used by the repeat modes
+        :return: A boolean that indicates if a track was started right away
+        """
+        if self._queue is None:
+            return False
+
+        track = self._queue.next_track(finished)
+        if isinstance(track, str):
+            if self._advance_task:
+                self._advance_task.cancel()
+            self._advance_task = asyncio.ensure_future(self._play_query(track))
+            return False
+        if track is None:
+            return False
+
+        await self.play(track, no_replace=False)
+        return True
+
+    async def _play_query(self, query):
+        """
+        Resolve a query from the queue and play it, moving on to the next track when it doesn't resolve
+        """
+        track = query
+        while isinstance(track, str):
+            track = await self._resolve(track) or self._queue.pop()
+        if track is None:
+            return
+        if self.current is not None:
+            # Something else was played in the meantime, keep the track for later
+            self._queue.push_left(track)
+            return
+        try:
+            await self.play(track, no_replace=False)
+        except LavalinkException:
+            traceback.print_exc()
+
+    async def _resolve(self, query):
+        try:
+            playlist = await self.link.get_tracks(query)
+        except LavalinkException:
+            traceback.print_exc()
+            return None
+        return None if playlist.is_empty else playlist[0]
+
+    async def _prefetch(self, query):
+        track = await self._resolve(query)
+        # The queue might've changed in the meantime
+        if self._queue and self._queue.peek() is query:
+            if track:
+                self._queue[0] = track
+            else:
+                self._queue.pop()
+        # The head might be another query by now, either way this prefetch is over
+        self._prefetch_task = None
+        self._schedule_prefetch()
+
+    def _schedule_prefetch(self):
+        if not self.auto_advance or not self._queue:
+            return
+        if self._prefetch_task and not self._prefetch_task.done():
+            return
+        if isinstance(self._queue.peek(), str):
+            self._prefetch_task = asyncio.ensure_future(self._prefetch(self._queue.peek()))
+
+    def _queue_head_changed(self):
+        # A query queued while a track is playing should be resolved before that track ends
+        if self.current is not None:
+            self._schedule_prefetch()
+
+    def track_started(self):
+        """
+        Called when Lavalink reports that a track started, records the silence since the last track
+        """
+        if self._ended_at is not None:
+            self.link.lavalink.advance_gaps.add(time() - self._ended_at)
+            self._ended_at = None
+        self._schedule_prefetch()
 
-            if self.paused:
-                await self.set_paused(True)
+    def track_ended(self, reason):
+        """
+        Called when Lavalink reports that a track ended
+        :param reason: The reason the track ended
+        """
+        if reason == "FINISHED":
+            self._ended_at = time()
+
+    def snapshot_state(self):
+        """
+        Get the state of the player as something JSON serializable
+        """
+        state = {
+            "current": serialize_track(self.current) if self.current else None,
+            "position": self.position if self.current else 0,
+            "paused": self.paused,
+            "volume": self.volume,
+            "equalizer": [self.equalizer[band] for band in range(15)],
+            "bass_mode": self.bass_mode.value,
+            "auto_advance": self.auto_advance,
+        }
+        if self._queue:
+            state["queue"] = [serialize_track(track) for track in self._queue]
+            state["repeat"] = self._queue.repeat.value
+            state["compact"] = self._queue.compact
+        return state
 
-        if self.volume != 100:
-            await self.set_volume(self.volume)
+    def restore_state(self, state):
+        """
+        Restore a state from `snapshot_state`, this doesn't send anything to Lavalink
+        """
+        interner = self.link.lavalink.track_interner
+        self.current = deserialize_track(state["current"], interner) if state["current"] else None
+        self._position = state["position"]
+        self.update_time = time()
+        self.paused = state["paused"]
+        self.volume = state["volume"]
+        self.equalizer = dict(enumerate(state["equalizer"]))
+        self.bass_mode = BassModes(state["bass_mode"])
+        self.auto_advance = state["auto_advance"]
+        if "queue" in state:
+            self._queue = self._new_queue(compact=state["compact"])
+            self._queue.extend(deserialize_track(track, interner) for track in state["queue"])
+            self._queue.repeat = RepeatMode(state["repeat"])
+
+    @property
+    def has_flat_equalizer(self):
+        return not any(self.equalizer.values())
+
+    def state_replay(self):
+        """
+        Build the messages that recreate this player on a fresh node, as few as possible
+
+        The track is started at the current position with the pause state and volume in the same message,
+        followed by the equalizer if it isn't flat.
+
+        :return: A list of payloads
+        """
+        guild_id = str(self.link.guild_id)
+        replay = []
+        if self.current:
+            position = max(self._position, 0) if self.update_time < 0 else self.position
+            replay.append({
+                "op": "play",
+                "guildId": guild_id,
+                "track": self.current.encoded_track,
+                "startTime": position,
+                "pause": self.paused,
+                "volume": self.volume,
+                "noReplace": False
+            })
+            self._position = position
+            self.update_time = time()
+        elif self.volume != 100:
+            replay.append({"op": "volume", "guildId": guild_id, "volume": self.volume})
+
+        if not self.has_flat_equalizer:
+            bands = [{"band": band, "gain": gain} for band, gain in self.equalizer.items() if gain]
+            replay.append({"op": "equalizer", "guildId": guild_id, "bands": bands})
+        return replay
+
+    async def node_changed(self):
+        """
+        Replay the player's state to the link's node
+        """
+        replay = self.state_replay()
+        if replay:
+            await self.link.node.send_batch(replay)
 
     async def trigger_event(self, event):
         await Player.internal_event_adapter.on_event(event)
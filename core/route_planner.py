@@ -0,0 +1,80 @@
+import time
+from collections import deque
+
+
+class RoutePlannerHealth:
+    """
+    How well a node is loading tracks: its route planner's failing addresses and its recent load failures
+
+    YouTube rate limits the IP blocks of busy nodes, their route planner marks the addresses
+    as failing and `/loadtracks` fails or slows down, while other nodes are fine.
+    """
+    def __init__(self, window=300, max_failure_rate=0.3, min_loads=5, max_failing_addresses=10):
+        """
+        :param window: The amount of seconds load results are remembered
+        :param max_failure_rate: The share of failed loads in the window at which the node counts as rate limited
+        :param min_loads: The amount of loads in the window needed before the failure rate counts
+        :param max_failing_addresses: The amount of failing addresses at which the node counts as rate limited
+        """
+        self.window = window
+        self.max_failure_rate = max_failure_rate
+        self.min_loads = min_loads
+        self.max_failing_addresses = max_failing_addresses
+
+        # False once the node turned out not to have a route planner endpoint
+        self.supported = True
+        self.planner_class = None
+        self.failing_addresses = 0
+        self.polled_at = None
+        self._loads = deque()
+
+    def update(self, status):
+        """
+        Record a response of `/routeplanner/status`, None if the node has no route planner configured
+        """
+        self.polled_at = time.time()
+        if not status or not status.get("class"):
+            self.planner_class = None
+            self.failing_addresses = 0
+            return
+        self.planner_class = status["class"]
+        details = status.get("details")
+        failing = details.get("failingAddresses") if isinstance(details, dict) else None
+        self.failing_addresses = len(failing) if isinstance(failing, list) else 0
+
+    def record_load(self, succeeded, now=None):
+        """
+        Record the outcome of a track load, loads that returned LOAD_FAILED count as failed
+        """
+        now = time.monotonic() if now is None else now
+        self._loads.append((now, succeeded))
+        self._prune(now)
+
+    def _prune(self, now):
+        while self._loads and now - self._loads[0][0] > self.window:
+            self._loads.popleft()
+
+    @property
+    def recent_failures(self):
+        self._prune(time.monotonic())
+        return sum(1 for _, succeeded in self._loads if not succeeded)
+
+    @property
+    def failure_rate(self):
+        self._prune(time.monotonic())
+        if len(self._loads) < self.min_loads:
+            return 0.0
+        return sum(1 for _, succeeded in self._loads if not succeeded) / len(self._loads)
+
+    @property
+    def rate_limited(self):
+        return self.failing_addresses >= self.max_failing_addresses or self.failure_rate >= self.max_failure_rate
+
+    @property
+    def penalty(self):
+        """
+        0 for nodes that load fine, otherwise higher the worse it's rate limited
+        """
+        if not self.rate_limited:
+            return 0
+        return 1 + self.failing_addresses + 10 * self.recent_failures
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from .exceptions import NodeException
+from .player import AudioTrackPlaylist
+
+logger = logging.getLogger("magma")
+
+_separators = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """
+    Lowercase a text and collapse everything that isn't a letter or a digit into single spaces
+    """
+    return _separators.sub(" ", text.lower()).strip()
+
+
+class SearchSuggester:
+    """
+    Search suggestions for autocomplete, answered from the tracks of recent searches when possible
+
+    The titles and authors of recently found tracks are kept in a sorted array of keys, one for every
+    word a title could be typed from, so a prefix is looked up with a binary search. Only when the
+    index doesn't have enough tracks for a prefix and it wasn't searched recently the query goes to a node,
+    and a user's search that's still waiting when they type the next keystroke is cancelled.
+    """
+    def __init__(self, lavalink, source="ytsearch:", capacity=5000, query_capacity=1000, query_ttl=600,
+                 min_results=5, min_length=2, debounce=0.3, timeout=2.5, max_words=12):
+        """
+        :param lavalink: The Lavalink instance whose nodes load the tracks
+        :param source: The search prefix that's put in front of the queries sent to the nodes
+        :param capacity: The max amount of tracks in the index, the least recently used ones are dropped
+        :param query_capacity: The max amount of queries whose results are remembered
+        :param query_ttl: The amount of seconds the results of a query are remembered
+        :param min_results: The amount of tracks the index must have for a prefix to answer it locally
+        :param min_length: Shorter queries are answered from the index only
+        :param debounce: The amount of seconds to wait for the next keystroke before asking a node
+        :param timeout: The max amount of seconds a suggestion may take, Discord gives up after 3
+        :param max_words: The max amount of words of a track that searches can start from
+        """
+        self.lavalink = lavalink
+        self.source = source
+        self.capacity = capacity
+        self.query_capacity = query_capacity
+        self.query_ttl = query_ttl
+        self.min_results = min_results
+        self.min_length = min_length
+        self.debounce = debounce
+        self.timeout = timeout
+        self.max_words = max_words
+
+        self.tracks = OrderedDict()
+        self.queries = OrderedDict()
+        self._index = []
+        # Index entries of tracks that were dropped, they're skipped until the index is compacted
+        self._stale = 0
+        self._pending = {}
+
+        self.local_hits = 0
+        self.remote_loads = 0
+        self.superseded = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _keys(self, track):
+        words = normalize(f"{track.author or ''} {track.title or ''}").split()
+        return {" ".join(words[i:]) for i in range(min(len(words), self.max_words))}
+
+    def add(self, tracks):
+        """
+        Add tracks to the index
+        :param tracks: AudioTracks
+        """
+        for track in tracks:
+            encoded = track.encoded_track
+            if encoded in self.tracks:
+                self.tracks.move_to_end(encoded)
+                continue
+            self.tracks[encoded] = track
+            for key in self._keys(track):
+                entry = (key, encoded)
+                i = bisect_left(self._index, entry)
+                if i < len(self._index) and self._index[i] == entry:
+                    # The track was dropped before and its entry wasn't compacted yet, it's in use again
+                    self._stale -= 1
+                else:
+                    self._index.insert(i, entry)
+        while len(self.tracks) > self.capacity:
+            _, track = self.tracks.popitem(last=False)
+            self._stale += len(self._keys(track))
+        if self._stale > len(self._index) // 2:
+            self._compact()
+
+    def _compact(self):
+        self._index = [entry for entry in self._index if entry[1] in self.tracks]
+        self._stale = 0
+
+    def _cached(self, prefix):
+        """
+        Get the remembered results of a query, None if it wasn't searched recently
+        """
+        cached = self.queries.get(prefix)
+        if not cached:
+            return None
+        expires, encoded_tracks = cached
+        if expires <= time.monotonic():
+            del self.queries[prefix]
+            return None
+        return [self.tracks[encoded] for encoded in encoded_tracks if encoded in self.tracks]
+
+    def lookup(self, text, limit=25):
+        """
+        Find indexed tracks that have a word sequence starting with the text
+
+        :param text: What the user typed
+        :param limit: The max amount of tracks
+        :return: A list of AudioTracks
+        """
+        prefix = normalize(text)
+        cached = self._cached(prefix)
+        if cached is not None:
+            return cached[:limit]
+        if not prefix:
+            return []
+
+        found = []
+        seen = set()
+        index = self._index
+        i = bisect_left(index, (prefix,))
+        while i < len(index) and index[i][0].startswith(prefix) and len(found) < limit:
+            encoded = index[i][1]
+            if encoded not in seen and encoded in self.tracks:
+                seen.add(encoded)
+                found.append(self.tracks[encoded])
+            i += 1
+        return found
+
+    def _remember(self, prefix, tracks):
+        self.queries[prefix] = (time.monotonic() + self.query_ttl, [track.encoded_track for track in tracks])
+        self.queries.move_to_end(prefix)
+        while len(self.queries) > self.query_capacity:
+            self.queries.popitem(last=False)
+
+    async def _load(self, query):
+        """
+        Load a search from the best node, moving on to the next one when it fails
+        """
+        for node in await self.lavalink.load_balancer.track_loading_nodes():
+            try:
+                results = await node.get_tracks(self.source + query)
+            except NodeException as e:
+                logger.warning(e.msg)
+                continue
+            if results:
+                return AudioTrackPlaylist(results, self.lavalink.track_interner).tracks
+        return []
+
+    async def _search(self, prefix):
+        await asyncio.sleep(self.debounce)
+        self.remote_loads += 1
+        tracks = await self._load(prefix)
+        self.add(tracks)
+        self._remember(prefix, tracks)
+        return tracks
+
+    async def suggest(self, user_id, text, limit=25):
+        """
+        Get tracks for what a user has typed so far
+
+        :param user_id: The user typing, their previous search is cancelled if it's still waiting
+        :param text: What the user typed
+        :param limit: The max amount of tracks, Discord shows 25 choices
+        :return: A list of AudioTracks, possibly from the index only when the node was too slow
+        """
+        prefix = normalize(text)
+        cached = self._cached(prefix)
+        if cached is not None:
+            # Searched recently, the node would answer the same
+            self.local_hits += 1
+            return cached[:limit]
+
+        local = self.lookup(text, limit)
+        if len(local) >= min(self.min_results, limit) or len(prefix) < self.min_length:
+            self.local_hits += 1
+            return local
+
+        previous = self._pending.get(user_id)
+        if previous and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+
+        task = asyncio.ensure_future(self._search(prefix))
+        self._pending[user_id] = task
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self._pending.get(user_id) is task:
+                del self._pending[user_id]
+
+        if not done or task.cancelled():
+            # Superseded by the next keystroke, or too slow for Discord
+            if not done:
+                # Let it finish so the next keystroke can use the results
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return local
+        if task.exception():
+            logger.warning(f"Loading search suggestions failed: {task.exception()!r}")
+            return local
+        return task.result()[:limit] or local
@@ -0,0 +1,178 @@
+import time
+from array import array
+
+
+class NodeStats:
+    """
+    A single stats frame of a node, the raw message isn't kept
+    """
+    __slots__ = ("players", "playing_players", "uptime", "mem_free", "mem_used", "mem_allocated", "mem_reservable",
+                 "cpu_cores", "system_load", "lavalink_load", "avg_frame_sent", "avg_frame_nulled",
+                 "avg_frame_deficit")
+
+    def __init__(self, msg):
+        self.players = msg.get("players")
+        self.playing_players = msg.get("playingPlayers")
+        self.uptime = msg.get("uptime")
+
+        mem = msg.get("memory")
+        self.mem_free = mem.get("free")
+        self.mem_used = mem.get("used")
+        self.mem_allocated = mem.get("allocated")
+        self.mem_reservable = mem.get("reserveable")
+
+        cpu = msg.get("cpu")
+        self.cpu_cores = cpu.get("cores")
+        self.system_load = cpu.get("systemLoad")
+        self.lavalink_load = cpu.get("lavalinkLoad")
+
+        frames = msg.get("frameStats")
+        if frames:
+            # These are per minute
+            self.avg_frame_sent = frames.get("sent")
+            self.avg_frame_nulled = frames.get("nulled")
+            self.avg_frame_deficit = frames.get("deficit")
+        else:
+            self.avg_frame_sent = -1
+            self.avg_frame_nulled = -1
+            self.avg_frame_deficit = -1
+
+
+class StatsHistory:
+    """
+    A fixed size ring buffer of a node's stats frames, with an exponentially weighted moving
+    average of every field so decisions don't hinge on a single noisy frame
+    """
+    FIELDS = ("players", "playing_players", "system_load", "lavalink_load",
+              "avg_frame_sent", "avg_frame_nulled", "avg_frame_deficit")
+
+    def __init__(self, size=60, alpha=0.3):
+        """
+        :param size: The amount of frames kept, Lavalink sends one every minute
+        :param alpha: The weight of the newest frame in the moving averages, from 0-1
+        """
+        self.size = size
+        self.alpha = alpha
+        self.count = 0
+        self._index = 0
+        self._timestamps = array("d", bytes(8 * size))
+        self._columns = {field: array("d", bytes(8 * size)) for field in self.FIELDS}
+        self._ewma = dict.fromkeys(self.FIELDS)
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def add(self, stats, timestamp=None):
+        """
+        Record a stats frame
+        :param stats: The NodeStats
+        :param timestamp: When the frame was received, defaults to now
+        """
+        index = self._index
+        self._timestamps[index] = time.time() if timestamp is None else timestamp
+        for field in self.FIELDS:
+            value = getattr(stats, field)
+            value = -1 if value is None else value
+            self._columns[field][index] = value
+            if value == -1:
+                continue  # frame stats are missing when nothing is playing
+
+            previous = self._ewma[field]
+            self._ewma[field] = value if previous is None else self.alpha * value + (1 - self.alpha) * previous
+
+        self._index = (index + 1) % self.size
+        self.count += 1
+
+    @property
+    def last_timestamp(self):
+        """
+        When the newest frame was received, 0 if there is none
+        """
+        if not self.count:
+            return 0
+        return self._timestamps[self._index - 1]
+
+    def _ordered(self, column):
+        if self.count < self.size:
+            return list(column[:self.count])
+        return list(column[self._index:]) + list(column[:self._index])
+
+    def values(self, field):
+        """
+        Get the recorded values of a field, from the oldest to the newest
+        """
+        return self._ordered(self._columns[field])
+
+    def smoothed(self, field):
+        """
+        Get the moving average of a field, None if it was never recorded
+        """
+        return self._ewma[field]
+
+    def trend(self, field):
+        """
+        Get how fast a field is changing per second, using a least squares fit over the history
+        """
+        points = [(t, v) for t, v in zip(self._ordered(self._timestamps), self.values(field)) if v != -1]
+        if len(points) < 2:
+            return 0.0
+        mean_t = sum(t for t, _ in points) / len(points)
+        mean_v = sum(v for _, v in points) / len(points)
+        variance = sum((t - mean_t) ** 2 for t, _ in points)
+        if not variance:
+            return 0.0
+        return sum((t - mean_t) * (v - mean_v) for t, v in points) / variance
+
+    def export(self):
+        """
+        Get the history as a dict of lists, for dashboards
+        """
+        exported = {"timestamps": self._ordered(self._timestamps)}
+        for field in self.FIELDS:
+            exported[field] = self.values(field)
+        exported["smoothed"] = dict(self._ewma)
+        return exported
+
+
+class NodeLoad:
+    """
+    The numbers the load balancer looks at for a node
+    """
+    __slots__ = ("playing_players", "system_load", "frame_deficit", "frame_nulled", "pending")
+
+    def __init__(self, playing_players, system_load, frame_deficit=-1, frame_nulled=-1, pending=0):
+        """
+        :param playing_players: The playing players in the node's last stats frame
+        :param system_load: The smoothed system load
+        :param frame_deficit: The smoothed frame deficit per minute, -1 if unknown
+        :param frame_nulled: The smoothed nulled frames per minute, -1 if unknown
+        :param pending: The players assigned to the node since that stats frame
+        """
+        self.playing_players = playing_players
+        self.system_load = system_load
+        self.frame_deficit = frame_deficit
+        self.frame_nulled = frame_nulled
+        self.pending = pending
+
+    @classmethod
+    def from_node(cls, node):
+        """
+        Get the load of a node as seen by this process, None if it hasn't sent stats yet
+        """
+        stats = node.stats
+        if not stats:
+            return None
+
+        history = node.stats_history
+        system_load = history.smoothed("system_load")
+        if system_load is None:
+            system_load = stats.system_load
+
+        frame_deficit = frame_nulled = -1
+        if stats.avg_frame_deficit != -1:
+            frame_deficit = history.smoothed("avg_frame_deficit")
+            frame_nulled = history.smoothed("avg_frame_nulled")
+            if frame_deficit is None:
+                frame_deficit, frame_nulled = stats.avg_frame_deficit, stats.avg_frame_nulled
+
+        return cls(stats.playing_players, system_load, frame_deficit, frame_nulled, node.pending_players)
@@ -0,0 +1,199 @@
+"""
+A stats board in shared memory, so bot processes on the same host balance players as one
+
+Every process has a row with a cell per node, in which it publishes the load of the node as it
+sees it and how many players it assigned to the node since the node's last stats frame. Each cell
+has one writer, readers use its sequence number to skip cells that are being written (a seqlock).
+
+Layout:
+    header      magic, node count, process count
+    node names  node count * 64 bytes
+    rows        process count * (pid, heartbeat, node count * cell)
+    cell        sequence, stats time, playing players, system load, frame deficit, frame nulled, pending
+"""
+
+import logging
+import os
+import struct
+import time
+
+from .exceptions import IllegalAction
+from .stats import NodeLoad
+
+logger = logging.getLogger("magma")
+
+MAGIC = b"MAGMASB1"
+HEADER = struct.Struct("<8sII")
+NAME = struct.Struct("<64s")
+ROW_HEADER = struct.Struct("<qd")
+SEQUENCE = struct.Struct("<Q")
+CELL = struct.Struct("<Q6d")
+CELL_DATA = struct.Struct("<6d")
+# A cell that stays odd this long was left half written by a process that died
+MAX_READ_ATTEMPTS = 100
+
+
+def _open_shared_memory(name, create=False, size=0):
+    from multiprocessing.shared_memory import SharedMemory
+
+    if create:
+        return SharedMemory(name=name, create=True, size=size)
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 unlinks attached segments when the process exits
+        shm = SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class StatsBoard:
+    """
+    A fixed layout table of node loads shared by the bot processes on a host
+    """
+    def __init__(self, shm, process_index=None, stale_after=180):
+        self.shm = shm
+        self.buf = shm.buf
+        self.process_index = process_index
+        self.stale_after = stale_after
+
+        magic, self.node_count, self.process_count = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise IllegalAction(f"{shm.name} isn't a stats board")
+
+        self.node_names = []
+        for i in range(self.node_count):
+            name, = NAME.unpack_from(self.buf, HEADER.size + i * NAME.size)
+            self.node_names.append(name.rstrip(b"\0").decode())
+        self._slots = {name: i for i, name in enumerate(self.node_names)}
+
+        self._rows_offset = HEADER.size + self.node_count * NAME.size
+        self._row_size = ROW_HEADER.size + self.node_count * CELL.size
+
+        if process_index is not None:
+            if not 0 <= process_index < self.process_count:
+                raise IllegalAction(f"The process index must be below {self.process_count}")
+            ROW_HEADER.pack_into(self.buf, self._row_offset(process_index), os.getpid(), time.time())
+
+    @classmethod
+    def size_for(cls, node_count, process_count):
+        return HEADER.size + node_count * NAME.size + process_count * (ROW_HEADER.size + node_count * CELL.size)
+
+    @classmethod
+    def create(cls, name, node_names, process_count=16, process_index=None, stale_after=180):
+        """
+        Create a board, this should be done once per host before the bot processes start
+
+        :param name: The name of the shared memory block
+        :param node_names: The names of all nodes the processes can use
+        :param process_count: The max amount of bot processes
+        :param process_index: The row of this process, None if it doesn't publish
+        :param stale_after: The amount of seconds after which the row of a silent process is ignored
+        :return: A StatsBoard
+        """
+        shm = _open_shared_memory(name, create=True, size=cls.size_for(len(node_names), process_count))
+        shm.buf[:] = bytes(shm.size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, len(node_names), process_count)
+        for i, node_name in enumerate(node_names):
+            encoded = node_name.encode()
+            if len(encoded) > NAME.size:
+                raise IllegalAction(f"Node names on a stats board can't be longer than {NAME.size} bytes")
+            NAME.pack_into(shm.buf, HEADER.size + i * NAME.size, encoded)
+        return cls(shm, process_index, stale_after)
+
+    @classmethod
+    def attach(cls, name, process_index, stale_after=180):
+        """
+        Open a board created by `create`
+
+        :param name: The name of the shared memory block
+        :param process_index: The row of this process, for example its cluster id, unique per process
+        :param stale_after: The amount of seconds after which the row of a silent process is ignored
+        :return: A StatsBoard
+        """
+        return cls(_open_shared_memory(name), process_index, stale_after)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Remove the board from the host, the processes that have it open can keep using it
+        """
+        self.shm.unlink()
+
+    def _row_offset(self, process_index):
+        return self._rows_offset + process_index * self._row_size
+
+    def _cell_offset(self, process_index, slot):
+        return self._row_offset(process_index) + ROW_HEADER.size + slot * CELL.size
+
+    def publish(self, node):
+        """
+        Write the load of a node as this process sees it
+        """
+        slot = self._slots.get(node.name)
+        if self.process_index is None or slot is None:
+            return
+
+        load = NodeLoad.from_node(node)
+        if load is None:
+            data = (0, 0, 0, -1, -1, node.pending_players)
+        else:
+            data = (node.stats_history.last_timestamp, load.playing_players, load.system_load,
+                    load.frame_deficit, load.frame_nulled, load.pending)
+
+        now = time.time()
+        offset = self._cell_offset(self.process_index, slot)
+        sequence, = SEQUENCE.unpack_from(self.buf, offset)
+        # An odd sequence is left behind by a previous process in this row that died while writing
+        sequence += sequence % 2
+        SEQUENCE.pack_into(self.buf, offset, sequence + 1)
+        CELL_DATA.pack_into(self.buf, offset + SEQUENCE.size, *data)
+        SEQUENCE.pack_into(self.buf, offset, sequence + 2)
+        ROW_HEADER.pack_into(self.buf, self._row_offset(self.process_index), os.getpid(), now)
+
+    def _read_cell(self, offset):
+        """
+        Read a cell once its writer isn't writing it, None if it never finishes
+        """
+        for _ in range(MAX_READ_ATTEMPTS):
+            before, = SEQUENCE.unpack_from(self.buf, offset)
+            if before % 2:
+                continue
+            data = CELL_DATA.unpack_from(self.buf, offset + SEQUENCE.size)
+            after, = SEQUENCE.unpack_from(self.buf, offset)
+            if before == after:
+                return data
+        return None
+
+    def load(self, node):
+        """
+        Get the load of a node over all processes: the freshest stats any of them has,
+        plus the players all of them assigned since
+
+        :return: A NodeLoad, None if no process has stats of the node
+        """
+        slot = self._slots.get(node.name)
+        if slot is None:
+            return None
+
+        now = time.time()
+        freshest = None
+        pending = 0
+        for process_index in range(self.process_count):
+            pid, heartbeat = ROW_HEADER.unpack_from(self.buf, self._row_offset(process_index))
+            if not pid or now - heartbeat > self.stale_after:
+                continue
+            data = self._read_cell(self._cell_offset(process_index, slot))
+            if data is None:
+                continue
+            pending += data[5]
+            if data[0] and (freshest is None or data[0] > freshest[0]):
+                freshest = data
+
+        if freshest is None:
+            return None
+        _, playing_players, system_load, frame_deficit, frame_nulled, _ = freshest
+        return NodeLoad(int(playing_players), system_load, frame_deficit, frame_nulled, int(pending))
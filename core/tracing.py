@@ -0,0 +1,172 @@
+import logging
+import time
+
+from .miscellaneous import SampleWindow
+
+logger = logging.getLogger("magma")
+
+
+class Stages:
+    # The stages between a command and audio
+    COMMAND = "command"
+    GET_TRACKS = "get_tracks"
+    SELECT_NODE = "select_node"
+    VOICE_HANDSHAKE = "voice_handshake"
+    VOICE_UPDATE = "voice_update"
+    PLAY = "play"
+    TRACK_START = "track_start"
+
+
+class Span:
+    """
+    A single timed stage for a guild
+    """
+    __slots__ = ("tracer", "guild_id", "stage", "start_ns", "start", "duration")
+
+    def __init__(self, tracer, guild_id, stage):
+        self.tracer = tracer
+        self.guild_id = guild_id
+        self.stage = stage
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    @property
+    def end_ns(self):
+        return self.start_ns + int(self.duration * 1e9)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+            self.tracer.export(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+
+class _NullSpan:
+    """
+    Returned for guilds that aren't sampled so tracing costs next to nothing
+    """
+    __slots__ = ()
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class CallbackExporter:
+    """
+    Calls a function with every finished Span
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def export(self, span):
+        self.callback(span)
+
+
+class OpenTelemetryExporter:
+    """
+    Forwards finished Spans to OpenTelemetry, requires `opentelemetry-api` to be installed
+    """
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self.tracer = tracer or trace.get_tracer("magma")
+
+    def export(self, span):
+        otel_span = self.tracer.start_span(
+            f"magma.{span.stage}",
+            start_time=span.start_ns,
+            attributes={"magma.guild_id": str(span.guild_id), "magma.stage": span.stage}
+        )
+        otel_span.end(end_time=span.end_ns)
+
+
+class Tracer:
+    """
+    Traces the latency between a command and the audio starting, per guild
+
+    Guilds are sampled deterministically so every stage of a sampled guild is traced,
+    a sample rate of 0 disables tracing
+    """
+    def __init__(self, sample_rate=0.0, exporters=None, window=1024):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters or [])
+        self.window = window
+        self.distributions = {}
+        self._open = {}
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def is_sampled(self, guild_id):
+        if self.sample_rate <= 0:
+            return False
+        if self.sample_rate >= 1:
+            return True
+        # Knuth's multiplicative hash spreads sequential snowflakes evenly
+        return (int(guild_id) * 2654435761 % 2 ** 32) / 2 ** 32 < self.sample_rate
+
+    def span(self, guild_id, stage):
+        """
+        Time a stage, use as a context manager
+        :param guild_id: The guild the stage belongs to
+        :param stage: The name of the stage
+        :return: A Span
+        """
+        if not self.is_sampled(guild_id):
+            return NULL_SPAN
+        return Span(self, guild_id, stage)
+
+    def begin(self, guild_id, stage):
+        """
+        Start a stage that is finished somewhere else with `finish`
+        """
+        if self.is_sampled(guild_id):
+            self._open[(guild_id, stage)] = Span(self, guild_id, stage)
+
+    def finish(self, guild_id, stage):
+        """
+        Finish a stage started with `begin`, nothing happens if it was never started
+        """
+        if not self._open:
+            return
+        span = self._open.pop((guild_id, stage), None)
+        if span:
+            span.finish()
+
+    def discard(self, guild_id):
+        """
+        Forget all unfinished stages of a guild
+        """
+        for key in [key for key in self._open if key[0] == guild_id]:
+            del self._open[key]
+
+    def export(self, span):
+        if span.stage not in self.distributions:
+            self.distributions[span.stage] = SampleWindow(self.window)
+        self.distributions[span.stage].add(span.duration)
+
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                logger.exception(f"Exporter {exporter} failed to export a span")
+
+    def summary(self):
+        """
+        Get the latency distribution (in seconds) of every stage
+        """
+        return {stage: window.summary() for stage, window in self.distributions.items()}
@@ -0,0 +1,267 @@
+import random
+from bisect import bisect_right
+from collections import deque
+from enum import Enum
+from itertools import chain
+
+
+class RepeatMode(Enum):
+    # What happens with a track once it finishes
+    NONE = 0
+    TRACK = 1
+    QUEUE = 2
+
+
+class TrackReference:
+    """
+    A compact stand-in for an AudioTrack, it only keeps what is needed to play the track
+    """
+    __slots__ = ("encoded_track", "duration", "seekable", "stream", "user_data")
+
+    def __init__(self, encoded_track, duration, seekable=True, stream=False, user_data=None):
+        self.encoded_track = encoded_track
+        self.duration = duration
+        self.seekable = seekable
+        self.stream = stream
+        self.user_data = user_data
+
+    @classmethod
+    def from_track(cls, track):
+        return cls(track.encoded_track, track.duration, track.seekable, track.stream, track.user_data)
+
+
+class TrackQueue:
+    """
+    A per-guild queue of tracks, stored as a list of small blocks
+
+    Pushing and popping at either end is O(1), indexed access, insertion, removal and moves
+    are O(log n + block size) after a cheap rebuild of the block offsets.
+    The total duration is kept up to date on every change instead of being summed.
+    """
+    def __init__(self, compact=False, block_size=256):
+        """
+        :param compact: If AudioTracks should be stored as compact TrackReferences
+        :param block_size: The target size of a block, blocks are split at twice this size
+        """
+        self.compact = compact
+        self.block_size = block_size
+        self.repeat = RepeatMode.NONE
+        self.duration = 0
+        self._blocks = []
+        self._offsets = None
+        self._len = 0
+        # Called without arguments whenever a different track ends up at the front of the queue
+        self.on_head_changed = None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        block, pos = self._locate(index)
+        return self._blocks[block][pos]
+
+    def __setitem__(self, index, track):
+        block, pos = self._locate(index)
+        track = self._prepare(track)
+        self.duration += self._duration_of(track) - self._duration_of(self._blocks[block][pos])
+        self._blocks[block][pos] = track
+        if block == 0 and pos == 0:
+            self._head_changed()
+
+    def __delitem__(self, index):
+        self.remove(index)
+
+    @staticmethod
+    def _duration_of(track):
+        # Streams don't have a meaningful length
+        if getattr(track, "stream", False):
+            return 0
+        return getattr(track, "duration", 0) or 0
+
+    def _prepare(self, track):
+        if self.compact and not isinstance(track, (TrackReference, str)):
+            return TrackReference.from_track(track)
+        return track
+
+    def _added(self, track):
+        self._len += 1
+        self.duration += self._duration_of(track)
+
+    def _removed(self, track):
+        self._len -= 1
+        self.duration -= self._duration_of(track)
+
+    def _head_changed(self):
+        if self.on_head_changed is not None:
+            self.on_head_changed()
+
+    def _locate(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+
+        if self._offsets is None:
+            offsets = []
+            total = 0
+            for block in self._blocks:
+                offsets.append(total)
+                total += len(block)
+            self._offsets = offsets
+
+        block = bisect_right(self._offsets, index) - 1
+        return block, index - self._offsets[block]
+
+    def push(self, track):
+        """
+        Add a track to the end of the queue
+        """
+        track = self._prepare(track)
+        if not self._blocks or len(self._blocks[-1]) >= self.block_size * 2:
+            self._blocks.append(deque())
+            if self._offsets is not None:
+                self._offsets.append(self._len)
+        self._blocks[-1].append(track)
+        self._added(track)
+        if self._len == 1:
+            self._head_changed()
+
+    def push_left(self, track):
+        """
+        Add a track to the front of the queue
+        """
+        track = self._prepare(track)
+        if not self._blocks or len(self._blocks[0]) >= self.block_size * 2:
+            self._blocks.insert(0, deque())
+        self._blocks[0].appendleft(track)
+        self._offsets = None
+        self._added(track)
+        self._head_changed()
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.push(track)
+
+    def pop(self):
+        """
+        Remove and return the first track, None if the queue is empty
+        """
+        if not self._len:
+            return None
+        block = self._blocks[0]
+        track = block.popleft()
+        if not block:
+            del self._blocks[0]
+        self._offsets = None
+        self._removed(track)
+        self._head_changed()
+        return track
+
+    def pop_right(self):
+        """
+        Remove and return the last track, None if the queue is empty
+        """
+        if not self._len:
+            return None
+        block = self._blocks[-1]
+        track = block.pop()
+        if not block:
+            self._blocks.pop()
+            if self._offsets is not None:
+                self._offsets.pop()
+        self._removed(track)
+        return track
+
+    def peek(self):
+        """
+        Get the first track without removing it, None if the queue is empty
+        """
+        if not self._len:
+            return None
+        return self._blocks[0][0]
+
+    def insert(self, index, track):
+        """
+        Insert a track before the index
+        """
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            return self.push(track)
+
+        track = self._prepare(track)
+        block, pos = self._locate(index)
+        self._blocks[block].insert(pos, track)
+        if len(self._blocks[block]) > self.block_size * 2:
+            self._split(block)
+        self._offsets = None
+        self._added(track)
+        if index == 0:
+            self._head_changed()
+
+    def _split(self, block):
+        items = self._blocks[block]
+        half = deque()
+        for _ in range(len(items) // 2):
+            half.appendleft(items.pop())
+        self._blocks.insert(block + 1, half)
+
+    def remove(self, index):
+        """
+        Remove and return the track at the index
+        """
+        block, pos = self._locate(index)
+        items = self._blocks[block]
+        track = items[pos]
+        del items[pos]
+        if not items:
+            del self._blocks[block]
+        self._offsets = None
+        self._removed(track)
+        if block == 0 and pos == 0:
+            self._head_changed()
+        return track
+
+    def move(self, source, destination):
+        """
+        Move the track at the source index to the destination index
+        """
+        self.insert(destination, self.remove(source))
+
+    def shuffle(self):
+        """
+        Shuffle the queue in place
+        """
+        tracks = list(self)
+        random.shuffle(tracks)
+        self._rebuild(tracks)
+        self._head_changed()
+
+    def clear(self):
+        self._blocks = []
+        self._offsets = None
+        self._len = 0
+        self.duration = 0
+
+    def _rebuild(self, tracks):
+        size = self.block_size
+        self._blocks = [deque(tracks[i:i + size]) for i in range(0, len(tracks), size)]
+        self._offsets = None
+
+    def next_track(self, finished=None):
+        """
+        Get the track to play next, taking the repeat mode into account
+        :param finished: The track that just finished, if any
+        :return: The next track, None if there is nothing left to play
+        """
+        if finished is not None:
+            if self.repeat == RepeatMode.TRACK:
+                return finished
+            if self.repeat == RepeatMode.QUEUE:
+                self.push(finished)
+        return self.pop()
@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from enum import Enum
+
+from .exceptions import TransportException
+
+logger = logging.getLogger("magma")
+
+
+class MessageType(Enum):
+    # The kinds of messages a Transport hands to the Node
+    TEXT = 0
+    CLOSED = 1
+    ERROR = 2
+
+
+class TransportMessage:
+    __slots__ = ("type", "data", "code", "reason")
+
+    def __init__(self, type, data=None, code=None, reason=None):
+        self.type = type
+        self.data = data
+        self.code = code
+        self.reason = reason
+
+
+class Compression:
+    """
+    permessage-deflate settings for a node's websocket, see `add_node(..., compression=...)`
+    """
+    def __init__(self, level=None, window_bits=15, client_context_takeover=True, server_context_takeover=True):
+        """
+        :param level: The zlib level our messages are compressed with, from 1 (fastest) to 9 (smallest),
+                      None for the transport's default
+        :param window_bits: The size of the compression window as a power of 2, from 9 to 15
+        :param client_context_takeover: Keep the compression context between our messages, saves bytes, costs memory
+        :param server_context_takeover: Ask the node to keep the context between its messages
+        """
+        self.level = level
+        self.window_bits = window_bits
+        self.client_context_takeover = client_context_takeover
+        self.server_context_takeover = server_context_takeover
+
+
+class TransportMetrics:
+    """
+    Counts what goes over a node's websocket, kept by the Node over reconnects
+
+    Wire bytes are the websocket frames as received, compressed or not, payload bytes are the
+    decoded text. `receive_time` is the time spent parsing and inflating the received frames.
+    """
+    __slots__ = ("compressed", "messages_received", "payload_received", "wire_received", "receive_time",
+                 "messages_sent", "payload_sent", "send_time")
+
+    def __init__(self):
+        self.compressed = False
+        self.messages_received = 0
+        self.payload_received = 0
+        self.wire_received = 0
+        self.receive_time = 0.0
+        self.messages_sent = 0
+        self.payload_sent = 0
+        self.send_time = 0.0
+
+    @property
+    def compression_ratio(self):
+        """
+        The received wire bytes per payload byte, lower is better, None before anything was received
+        """
+        if not self.payload_received:
+            return None
+        return self.wire_received / self.payload_received
+
+    def summary(self):
+        summary = {field: getattr(self, field) for field in self.__slots__}
+        summary["compression_ratio"] = self.compression_ratio
+        return summary
+
+
+class _MeteredProtocol(asyncio.Protocol):
+    """
+    Sits between the asyncio transport and the websocket library's protocol to count the received bytes
+    """
+    def __init__(self, protocol, metrics):
+        self._protocol = protocol
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._protocol, name)
+
+    def connection_made(self, transport):
+        self._protocol.connection_made(transport)
+
+    def connection_lost(self, exc):
+        self._protocol.connection_lost(exc)
+
+    def pause_writing(self):
+        self._protocol.pause_writing()
+
+    def resume_writing(self):
+        self._protocol.resume_writing()
+
+    def eof_received(self):
+        return self._protocol.eof_received()
+
+    def data_received(self, data):
+        start = time.perf_counter()
+        self._protocol.data_received(data)
+        self._metrics.receive_time += time.perf_counter() - start
+        self._metrics.wire_received += len(data)
+
+
+def _meter(transport, metrics):
+    # The transport is the asyncio one, under the websocket library
+    if transport is None:
+        logger.info("The websocket library's socket can't be reached, wire bytes aren't counted")
+    elif not isinstance(transport.get_protocol(), _MeteredProtocol):
+        transport.set_protocol(_MeteredProtocol(transport.get_protocol(), metrics))
+
+
+def _aiohttp_socket_transport(ws):
+    """
+    Get the asyncio transport under an aiohttp websocket, None if it can't be found
+
+    aiohttp has no public way to get it, its private `_conn` holds it in the 3.x versions.
+    """
+    import aiohttp
+    if aiohttp.__version__.split(".")[0] != "3":
+        return None
+    connection = getattr(ws, "_conn", None)
+    return getattr(connection, "transport", None)
+
+
+class Transport(ABC):
+    """
+    The websocket connection of a Node, implementations wrap a websocket library
+
+    Pings from the node are answered by the transport itself, pongs to our own pings
+    are reported through `on_pong` so the Node can time them.
+    """
+    def __init__(self, get_session=None):
+        """
+        :param get_session: A function returning the Node's `aiohttp.ClientSession`, for transports that need one
+        """
+        self.get_session = get_session
+        self.on_pong = None
+        # A Compression, False to disable it, None for the library's default
+        self.compression = None
+        self.metrics = TransportMetrics()
+        self._closed = False
+
+    @classmethod
+    def unsupported_compression(cls, compression):
+        """
+        Get the compression settings the transport can't honour
+        :param compression: A Compression
+        :return: A list of setting names, empty if all of them are honoured
+        """
+        return []
+
+    @property
+    @abstractmethod
+    def closed(self):
+        pass
+
+    @abstractmethod
+    async def connect(self, uri, headers):
+        """
+        Open the connection, raises a TransportException if the node can't be reached or refuses it
+        """
+        pass
+
+    @abstractmethod
+    async def recv(self):
+        """
+        Wait for the next text message, or for the connection to close
+        :return: A TransportMessage
+        """
+        pass
+
+    @abstractmethod
+    async def send(self, data):
+        pass
+
+    @abstractmethod
+    async def ping(self, payload):
+        pass
+
+    @abstractmethod
+    async def close(self, code=1000):
+        pass
+
+    def _received(self, data):
+        self.metrics.messages_received += 1
+        self.metrics.payload_received += len(data)
+        return TransportMessage(MessageType.TEXT, data)
+
+    async def _send_timed(self, send, data):
+        start = time.perf_counter()
+        await send(data)
+        self.metrics.send_time += time.perf_counter() - start
+        self.metrics.messages_sent += 1
+        self.metrics.payload_sent += len(data)
+
+    def _pong_received(self, payload):
+        if self.on_pong:
+            self.on_pong(payload)
+
+
+class AiohttpTransport(Transport):
+    """
+    A Transport using aiohttp, it shares the Node's HTTP connection pool
+    """
+    def __init__(self, get_session=None):
+        super().__init__(get_session)
+        self._ws = None
+
+    @classmethod
+    def unsupported_compression(cls, compression):
+        # aiohttp always compresses with zlib's fastest level and lets the node decide on context takeover
+        unsupported = []
+        if compression.level not in (None, 1):
+            unsupported.append("level")
+        if not compression.client_context_takeover:
+            unsupported.append("client_context_takeover")
+        if not compression.server_context_takeover:
+            unsupported.append("server_context_takeover")
+        return unsupported
+
+    @property
+    def closed(self):
+        return self._closed or not self._ws or self._ws.closed
+
+    async def connect(self, uri, headers):
+        import aiohttp
+        compress = 0
+        if self.compression:
+            compress = self.compression.window_bits
+        try:
+            # Pings are answered in `recv` so our own pongs can be timed
+            self._ws = await self.get_session().ws_connect(uri, headers=headers, autoping=False, compress=compress)
+        except aiohttp.WSServerHandshakeError as e:
+            raise TransportException(f"Handshake failed with status {e.status}", e.status)
+        except aiohttp.ClientConnectorError as e:
+            raise TransportException(f"Couldn't connect: {e}")
+        self.metrics.compressed = bool(self._ws.compress)
+        _meter(_aiohttp_socket_transport(self._ws), self.metrics)
+
+    async def recv(self):
+        from aiohttp import WSMsgType
+        while True:
+            msg = await self._ws.receive()
+            if msg.type == WSMsgType.TEXT:
+                return self._received(msg.data)
+            elif msg.type == WSMsgType.PING:
+                await self._ws.pong(msg.data)
+            elif msg.type == WSMsgType.PONG:
+                self._pong_received(msg.data)
+            elif msg.type == WSMsgType.ERROR:
+                return TransportMessage(MessageType.ERROR, self._ws.exception())
+            elif msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
+                self._closed = True
+                return TransportMessage(MessageType.CLOSED, code=self._ws.close_code, reason=msg.extra)
+
+    async def send(self, data):
+        await self._send_timed(self._ws.send_str, data)
+
+    async def ping(self, payload):
+        await self._ws.ping(payload)
+
+    async def close(self, code=1000):
+        self._closed = True
+        if self._ws:
+            await self._ws.close(code=code)
+
+
+class WebsocketsTransport(Transport):
+    """
+    A Transport using the `websockets` library
+    """
+    def __init__(self, get_session=None):
+        super().__init__(get_session)
+        self._ws = None
+
+    @property
+    def closed(self):
+        return self._closed or not self._ws or self._ws.close_code is not None
+
+    async def connect(self, uri, headers):
+        import websockets
+        try:
+            from websockets.asyncio.client import connect
+            header_option = "additional_headers"
+        except ImportError:  # websockets < 13
+            connect = websockets.connect
+            header_option = "extra_headers"
+
+        options = {header_option: headers}
+        if self.compression is False:
+            options["compression"] = None
+        elif self.compression:
+            from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+            compression = self.compression
+            options["compression"] = None
+            options["extensions"] = [ClientPerMessageDeflateFactory(
+                client_no_context_takeover=not compression.client_context_takeover,
+                server_no_context_takeover=not compression.server_context_takeover,
+                client_max_window_bits=compression.window_bits,
+                server_max_window_bits=compression.window_bits if compression.window_bits < 15 else None,
+                compress_settings=None if compression.level is None else {"level": compression.level}
+            )]
+
+        try:
+            # The Node sends its own pings
+            self._ws = await connect(uri, ping_interval=None, **options)
+        except websockets.exceptions.InvalidHandshake as e:
+            response = getattr(e, "response", None)
+            status = getattr(response, "status_code", None) or getattr(e, "status_code", None)
+            raise TransportException(f"Handshake failed with status {status}", status)
+        except OSError as e:
+            raise TransportException(f"Couldn't connect: {e}")
+        extensions = getattr(getattr(self._ws, "protocol", self._ws), "extensions", None)
+        self.metrics.compressed = bool(extensions)
+        _meter(self._ws.transport, self.metrics)
+
+    async def recv(self):
+        import websockets
+        while True:
+            try:
+                data = await self._ws.recv()
+            except websockets.ConnectionClosed:
+                self._closed = True
+                return TransportMessage(MessageType.CLOSED, code=self._ws.close_code, reason=self._ws.close_reason)
+            if isinstance(data, str):
+                return self._received(data)
+
+    async def send(self, data):
+        await self._send_timed(self._ws.send, data)
+
+    async def ping(self, payload):
+        waiter = await self._ws.ping(payload)
+        waiter.add_done_callback(lambda future: future.cancelled() or future.exception() or
+                                 self._pong_received(payload))
+
+    async def close(self, code=1000):
+        self._closed = True
+        if self._ws:
+            await self._ws.close(code=code)
+
+
+TRANSPORTS = {
+    "aiohttp": AiohttpTransport,
+    "websockets": WebsocketsTransport,
+}
+
+
+def get_transport(transport):
+    """
+    Get a Transport class by its name, Transport subclasses are returned as is
+    """
+    if isinstance(transport, str):
+        try:
+            return TRANSPORTS[transport]
+        except KeyError:
+            raise ValueError(f"Unknown transport: {transport}, choose from {', '.join(TRANSPORTS)}")
+    return transport